@@ -0,0 +1,322 @@
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # the batch searches are unavailable without NumPy
+
+# Best-first search over single player steps that expands whole blocks of states at once
+# with NumPy array operations instead of one node and one move at a time.
+#
+# A block is up to `block` queued states of one f value, held as an (N, boxes) array of box
+# cells plus arrays of player cells, g-costs and Zobrist keys. For all 4 x N candidate moves,
+# the neighbour lookups, wall and box collisions, dead squares, new positions, incremental
+# Zobrist keys and heuristic values are computed as array operations. Only the freeze
+# deadlock test, which follows chains of neighbouring boxes, runs per pushed child in Python.
+#
+# The explored set is a sorted array of keys, with the best g, parent key and move of each
+# state alongside, searched and extended with np.searchsorted / np.insert. Like
+# solver.FingerprintSet it holds fingerprints only. Reaching a state more cheaply reopens
+# it, so with a consistent heuristic the first goal popped is optimal; without a heuristic
+# the blocks are the layers of a breadth-first search.
+#
+# When the search is profiled, each batch's expand is timed as 'moves', the heuristic sums
+# as 'heuristic' and the de-duplication against the batch and the explored set as 'hashing'.
+#
+# With a memory limit set on the map, the explored arrays and the queued blocks are measured
+# after every batch (see trim), the same way SokobanMap.over_budget does for the other searches.
+
+BLOCK_STATES = 4096  # states expanded together
+
+
+class Tables:
+    """
+    Per-map lookup arrays, indexed by compact cell id. Every array has one extra entry at
+    the end for cell id -1 (an obstacle), which has no neighbours and is dead, so arrays of
+    cells can index them without masking out the -1s first.
+    """
+
+    def __init__(self, map_inst, heuristic):
+        n = len(map_inst.cells)
+        self.neighbours = np.array(map_inst.neighbours + [(-1, -1, -1, -1)], dtype=np.int32)
+        self.dead = np.frombuffer(bytes(map_inst.dead) + b'\x01', dtype=np.uint8).astype(bool)
+        self.target = np.zeros(n + 1, dtype=bool)
+        self.target[list(map_inst.cells_of(map_inst.tgt_bits))] = True
+        self.zobrist_box = np.array(map_inst.zobrist_box + [0], dtype=np.uint64)
+        self.zobrist_player = np.array(map_inst.zobrist_player + [0], dtype=np.uint64)
+        # per-box heuristic contribution of each cell; a state's heuristic is the sum over its boxes
+        if not heuristic or not map_inst.tgt_positions:
+            self.cost = np.zeros(n + 1, dtype=np.int64)
+        elif map_inst.heuristic_name == 'manhattan':
+            self.cost = np.array(map_inst.tgt_manhattan + [0], dtype=np.int64)
+        else:
+            # the matching heuristics pair boxes with distinct targets, which does not vectorise;
+            # each box's push distance to its nearest target is the bound they all improve on
+            self.cost = np.append(map_inst.push_table.min(axis=0).astype(np.int64), map_inst.UNREACHABLE)
+
+
+def expand(map_inst, tables, boxes, player, g, keys):
+    """
+    All legal children of a block of states, skipping pushes onto dead squares and pushes
+    that freeze a box off target (as apply_move does)
+    :return: (boxes, player, g, keys, parent keys, moves) of the children
+    """
+    neighbours = tables.neighbours
+    parts = []
+    for d in range(4):
+        step = neighbours[player, d]
+        hit = boxes == step[:, None]
+        pushing = hit.any(axis=1)
+        ahead = neighbours[step, d]
+        blocked = (step < 0) | (pushing & ((ahead < 0) | (boxes == ahead[:, None]).any(axis=1)))
+        dead = pushing & ~blocked & tables.dead[ahead]
+        map_inst.pruned_dead += int(np.count_nonzero(dead))
+        ok = ~(blocked | dead)
+
+        child_boxes = boxes[ok]
+        pushed = pushing[ok]
+        moved_to = ahead[ok]
+        child_boxes[hit[ok]] = moved_to[pushed]
+        frozen = np.zeros(len(child_boxes), dtype=bool)
+        for i in np.flatnonzero(pushed):
+            packed = 0
+            for c in child_boxes[i].tolist():
+                packed |= 1 << c
+            frozen[i] = map_inst.freeze_deadlock(packed, int(moved_to[i]))
+        map_inst.pruned_frozen += int(np.count_nonzero(frozen))
+        keep = ~frozen
+
+        step = step[ok]
+        child_keys = keys[ok] ^ tables.zobrist_player[player[ok]] ^ tables.zobrist_player[step]
+        child_keys[pushed] ^= tables.zobrist_box[step[pushed]] ^ tables.zobrist_box[moved_to[pushed]]
+        parts.append((child_boxes[keep], step[keep], g[ok][keep] + 1, child_keys[keep], keys[ok][keep],
+                      np.full(np.count_nonzero(keep), d, dtype=np.int8)))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+class Explored:
+    """
+    Explored set: sorted arrays of keys, with the best g, parent key and move of each state
+    alongside. New states go into a small recent run, which is merged into the main run
+    once it holds RECENT_LIMIT states, so that an insertion moves O(RECENT_LIMIT) entries
+    rather than the whole set. A key is in one run or the other, never both.
+    """
+    RECENT_LIMIT = 1 << 16
+
+    def __init__(self, key):
+        self.main = self.run([key], [0], [key], [-1])  # the root is its own parent, with no move
+        self.recent = self.run([], [], [], [])
+
+    @staticmethod
+    def run(keys, g, parents, moves):
+        return [np.array(keys, dtype=np.uint64), np.array(g, dtype=np.int32),
+                np.array(parents, dtype=np.uint64), np.array(moves, dtype=np.int8)]
+
+    def __len__(self):
+        return len(self.main[0]) + len(self.recent[0])
+
+    def memory(self):
+        """
+        Bytes held by the arrays of both runs, plus the copy of the main run that np.insert
+        makes while the recent run is merged into it
+        """
+        main = sum(column.nbytes for column in self.main)
+        return 2 * main + sum(column.nbytes for column in self.recent)
+
+    def locate(self, run, keys):
+        """
+        :return: (slots of keys in a non-empty run, mask of the keys found there)
+        """
+        slot = np.minimum(np.searchsorted(run[0], keys), len(run[0]) - 1)
+        return slot, run[0][slot] == keys
+
+    def g(self, keys):
+        """
+        Best g of keys that are all in the set
+        """
+        g = np.empty(len(keys), dtype=np.int32)
+        for run in (self.main, self.recent):
+            if not len(run[0]):
+                continue
+            slot, found = self.locate(run, keys)
+            g[found] = run[1][slot[found]]
+        return g
+
+    def update(self, keys, g, parents, moves):
+        """
+        Record unique child states: insert the new ones, and overwrite those reached more
+        cheaply than before
+        :return: mask of the children that are new or cheaper
+        """
+        known = np.zeros(len(keys), dtype=bool)
+        better = np.zeros(len(keys), dtype=bool)
+        for run in (self.main, self.recent):
+            if not len(run[0]):
+                continue
+            slot, found = self.locate(run, keys)
+            cheaper = found & (g < run[1][slot])
+            for column, values in zip(run[1:], (g, parents, moves)):
+                column[slot[cheaper]] = values[cheaper]
+            known |= found
+            better |= cheaper
+        new = ~known
+        self.recent = self.insert(self.recent, keys[new], g[new], parents[new], moves[new])
+        if len(self.recent[0]) >= self.RECENT_LIMIT:
+            self.main = self.insert(self.main, *self.recent)
+            self.recent = self.run([], [], [], [])
+        return new | better
+
+    def insert(self, run, keys, *columns):
+        # keys are sorted, so one np.insert per column merges them in linear time
+        at = np.searchsorted(run[0], keys)
+        return [np.insert(old, at, values) for old, values in zip(run, (keys,) + columns)]
+
+    def path(self, key, moves):
+        """
+        Follow the parent keys back from `key` to the root
+        :param moves: move symbols by direction
+        """
+        solution = []
+        while True:
+            for run in (self.main, self.recent):
+                i = np.searchsorted(run[0], key)
+                if i < len(run[0]) and run[0][i] == key:
+                    break
+            d = int(run[3][i])
+            if d < 0:
+                break
+            solution.append(moves[d])
+            key = run[2][i]
+        solution.reverse()
+        return solution
+
+
+def trim(map_inst, stats, buckets, explored, queued, row_bytes):
+    """
+    Memory check against map_inst.memory_limit: the explored arrays plus `row_bytes` per
+    queued state. Past the limit, whole blocks of the highest f are dropped until the
+    estimate is back under LOW_WATER of the limit. When the explored set alone is past
+    that, dropping cannot help and the search has to stop.
+    :return: (number of states left queued, True if the search must give up)
+    """
+    memory = {'state_keys': explored.memory(), 'frontier': queued * row_bytes}
+    total = sum(memory.values())
+    if stats.memory is None or total > sum(stats.memory.values()):
+        stats.memory = memory
+    if total <= map_inst.memory_limit:
+        return queued, False
+    low_water = int(map_inst.LOW_WATER * map_inst.memory_limit)
+    if memory['state_keys'] > low_water:
+        return queued, True
+    while buckets and memory['state_keys'] + queued * row_bytes > low_water:
+        f = max(buckets)
+        blocks = buckets[f]
+        dropped = len(blocks.pop()[1])
+        if not blocks:
+            del buckets[f]
+        queued -= dropped
+        stats.dropped += dropped
+    return queued, False
+
+
+def batched_search(map_inst, stats, heuristic=True, block=BLOCK_STATES):
+    """
+    Batched A* (or, without a heuristic, breadth-first search) from the map's initial state,
+    filling in stats as it goes
+    :param heuristic: use the vectorised heuristic (see Tables), else expand by g alone
+    :param block: most states expanded in one batch
+    :return: (shortest list of moves or None, number of states left queued, status for
+             SearchStats.finish: 'memory budget' if the search gave up on its memory limit,
+             else None)
+    """
+    if np is None:
+        raise RuntimeError('the batch searches need NumPy')
+    tables = Tables(map_inst, heuristic)
+    # timed once per batch, so it costs nothing to keep the counts when not profiling
+    phase_time = stats.phase_time if stats.phase_time is not None else dict.fromkeys(('moves', 'heuristic',
+                                                                                      'hashing'), 0.0)
+    clock = time.perf_counter
+    root = map_inst.rootNode
+    root_boxes = np.array([list(map_inst.cells_of(root.boxes))], dtype=np.int32)
+    explored = Explored(root.zkey)
+    # f -> list of blocks (boxes, player, g, keys)
+    buckets = {int(tables.cost[root_boxes].sum()): [(root_boxes, np.array([root.player], dtype=np.int32),
+                                                     np.zeros(1, dtype=np.int32),
+                                                     np.array([root.zkey], dtype=np.uint64))]}
+    queued = 1
+    stats.frontier_max = 1
+    row_bytes = 4 * root_boxes.shape[1] + 16  # box cells, player, g and key of a queued state
+    try:
+        while buckets:
+            # as many blocks of the lowest f as fit in one batch
+            f = min(buckets)
+            blocks = buckets[f]
+            batch = [blocks.pop()]
+            size = len(batch[0][1])
+            while blocks and size + len(blocks[-1][1]) <= block:
+                batch.append(blocks.pop())
+                size += len(batch[-1][1])
+            if not blocks:
+                del buckets[f]
+            queued -= size
+            boxes, player, g, keys = (np.concatenate(column) for column in zip(*batch)) if len(batch) > 1 \
+                else batch[0]
+
+            # drop states reached more cheaply after they were queued
+            began = clock()
+            live = g <= explored.g(keys)
+            phase_time['hashing'] += clock() - began
+            if not live.all():
+                boxes, player, g, keys = boxes[live], player[live], g[live], keys[live]
+            if not len(player):
+                continue
+            stats.expanded += len(player)
+            stats.checkpoint(queued, f)
+
+            goal = tables.target[boxes].all(axis=1)
+            if goal.any():
+                moves = [move for (move, dy, dx) in map_inst.MOVES]
+                return explored.path(keys[np.argmax(goal)], moves), queued, None
+
+            began = clock()
+            child_boxes, child_player, child_g, child_keys, parents, moves = expand(
+                map_inst, tables, boxes, player, g, keys)
+            phase_time['moves'] += clock() - began
+            stats.generated += len(child_player)
+
+            # one child per state, the cheapest: sort by key, then g
+            began = clock()
+            order = np.lexsort((child_g, child_keys))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = child_keys[order[1:]] != child_keys[order[:-1]]
+            order = order[first]
+            stats.duplicates += len(first) - len(order)
+            child_boxes, child_player, child_g = child_boxes[order], child_player[order], child_g[order]
+            child_keys, parents, moves = child_keys[order], parents[order], moves[order]
+
+            survive = explored.update(child_keys, child_g, parents, moves)
+            stats.duplicates += len(survive) - int(np.count_nonzero(survive))
+            child_boxes, child_player, child_g, child_keys = (
+                child_boxes[survive], child_player[survive], child_g[survive], child_keys[survive])
+            phase_time['hashing'] += clock() - began
+            began = clock()
+            h = tables.cost[child_boxes].sum(axis=1)
+            phase_time['heuristic'] += clock() - began
+            solvable = h < map_inst.UNREACHABLE
+            map_inst.pruned_dead += int(np.count_nonzero(~solvable))
+            child_f = child_g + h
+            for value in np.unique(child_f[solvable]).tolist():
+                rows = np.flatnonzero((child_f == value) & solvable)
+                for start in range(0, len(rows), block):
+                    part = rows[start:start + block]
+                    buckets.setdefault(value, []).append(
+                        (child_boxes[part], child_player[part], child_g[part], child_keys[part]))
+                    queued += len(part)
+            stats.frontier_max = max(stats.frontier_max, queued)
+            if map_inst.memory_limit:
+                queued, stop = trim(map_inst, stats, buckets, explored, queued, row_bytes)
+                if stop:
+                    return None, queued, 'memory budget'
+        return None, 0, None
+    finally:
+        stats.explored = len(explored)
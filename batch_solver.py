@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import glob
+import json
+import argparse
+import multiprocessing
+import multiprocessing.connection
+
+from solver import SokobanMap, TranspositionTable, PAGE_SIZE
+from level_cache import LevelCache, DEFAULT_SIZE
+
+try:
+    import resource
+except ImportError:
+    resource = None  # no per-process memory limit on this platform
+
+# Solve whole directories of Sokoban levels in parallel.
+#
+# Every level runs in its own worker process, at most --jobs at a time, so a level that
+# hangs or blows its memory budget can be killed without taking the rest of the batch
+# down. One JSON object is written per line as each level finishes, e.g.
+#
+#    python batch_solver.py testcases testcases/new -a push --heuristic matching
+
+
+ALGORITHMS = tuple(SokobanMap.SEARCHES)
+# share of a level's memory left after loading it that its search is budgeted; the rest
+# covers the expansions between the search's memory checks and the allocator's slack
+SEARCH_SHARE = 0.75
+
+
+def find_levels(paths):
+    """
+    Expand directories (searched recursively for .txt files) and glob patterns into a
+    sorted list of level files, without duplicates
+    :param paths: directories, files or glob patterns
+    """
+    levels = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if name.endswith('.txt'):
+                        levels.add(os.path.join(root, name))
+        else:
+            levels.update(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+    return sorted(levels)
+
+
+def process_memory():
+    """
+    :return: (address space, resident) sizes of this process in bytes, or None where /proc
+             is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            fields = f.read().split()
+        return int(fields[0]) * PAGE_SIZE, int(fields[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def limit_memory(map_inst, budget):
+    """
+    Hold a worker to `budget` bytes resident. RLIMIT_AS caps address space, which starts out
+    far larger than what is resident (NumPy and its thread pools reserve plenty they never
+    touch), so the hard limit is the address space after loading the level plus what is
+    left of the budget; the search is budgeted SEARCH_SHARE of that, so it degrades or
+    gives up before the hard limit is hit.
+    """
+    used = process_memory()
+    room = budget - used[1] if used is not None else budget
+    if room <= 0:
+        raise MemoryError('%d MB already resident after loading the level' % (used[1] // (1024 * 1024)))
+    if resource is not None and used is not None:
+        limit = used[0] + room
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    map_inst.memory_limit = int(SEARCH_SHARE * room)
+
+
+def solve_level(filename, options, conn):
+    """
+    Worker process body: solve one level and send a result dict back through conn
+    """
+    result = {'level': filename}
+    try:
+        cache = LevelCache(options['cache'], options['cache_size'] * 1024 * 1024) if options['cache'] else None
+        map_inst = SokobanMap(filename, options['heuristic'], cache)
+        map_inst.tt_size = options['tt_size']
+        map_inst.explored_backend = options['explored']
+        if options['memory_mb']:
+            limit_memory(map_inst, options['memory_mb'] * 1024 * 1024)
+        output = map_inst.search(options['algorithm'], cache, options['verify_cache'])
+        result.update(output.as_dict())
+    except MemoryError:
+        result = {'level': filename, 'status': 'memory limit'}
+    except Exception as e:
+        result = {'level': filename, 'status': 'error', 'error': repr(e)}
+    conn.send(result)
+    conn.close()
+
+
+def solve_all(levels, options, jobs, timeout, out=sys.stdout):
+    """
+    Solve every level in a pool of worker processes, writing one JSON line per level to
+    `out` as soon as it finishes (so lines are in completion order, not input order).
+    :param timeout: seconds allowed per level, None for no limit
+    :return: list of the result dicts
+    """
+    pending = list(reversed(levels))
+    running = {}  # process -> (level, receiving end of its pipe, start time)
+    results = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            level = pending.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=solve_level, args=(level, options, sender))
+            process.start()
+            sender.close()
+            running[process] = (level, receiver, time.time())
+
+        ready = multiprocessing.connection.wait([r for (l, r, s) in running.values()] +
+                                                [p.sentinel for p in running], timeout=0.1)
+        for process in list(running):
+            level, receiver, started = running[process]
+            result = None
+            if receiver in ready or process.sentinel in ready:
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    # died without reporting back, most likely killed by the memory limit
+                    process.join()
+                    result = {'level': level, 'status': 'crashed', 'exitcode': process.exitcode}
+            elif timeout is not None and time.time() - started > timeout:
+                process.terminate()
+                result = {'level': level, 'status': 'timeout', 'time': time.time() - started}
+            if result is not None:
+                process.join()
+                receiver.close()
+                del running[process]
+                results.append(result)
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    return results
+
+
+def main(arglist):
+    """
+    Solve every level found under the given directories / glob patterns in parallel
+    :param arglist: command line arguments, see --help
+    """
+    parser = argparse.ArgumentParser(description='Solve Sokoban level files in parallel, one JSON line per level.')
+    parser.add_argument('paths', nargs='+', help='level files, directories or glob patterns')
+    parser.add_argument('-a', '--algorithm', choices=ALGORITHMS, default='push')
+    parser.add_argument('--heuristic', choices=['manhattan', 'greedy', 'matching', 'pdb'], default='matching')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per level')
+    parser.add_argument('--memory', type=int, default=0,
+                        help='resident memory limit per level in MB (0: none); searches are budgeted '
+                             'three quarters of what is left after loading the level')
+    parser.add_argument('--tt-size', type=int, default=TranspositionTable.DEFAULT_SIZE)
+    parser.add_argument('--explored', choices=['table', 'fingerprint'], default='table',
+                        help='explored set of astar/ucs/push (see solver.py --explored)')
+    parser.add_argument('--cache', metavar='DIR', help='level cache directory (see solver.py --cache)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_SIZE // (1024 * 1024), metavar='MB',
+                        help='size the cache directory is trimmed to (default %(default)s)')
+    parser.add_argument('--verify-cache', action='store_true', help='replay cached solutions before using them')
+    args = parser.parse_args(arglist)
+
+    levels = find_levels(args.paths)
+    options = {'algorithm': args.algorithm, 'heuristic': args.heuristic,
+               'memory_mb': args.memory, 'tt_size': args.tt_size, 'explored': args.explored,
+               'cache': args.cache, 'cache_size': args.cache_size, 'verify_cache': args.verify_cache}
+    solve_all(levels, options, max(args.jobs, 1), args.timeout)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
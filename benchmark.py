@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing
+
+import bfsworking
+from solver import SokobanMap
+from batch_solver import find_levels
+
+try:
+    import resource
+except ImportError:
+    resource = None  # peak RSS is not recorded on this platform
+
+# End-to-end benchmark over the bundled levels.
+#
+# Every (level, algorithm) pair is solved --repeat times, each run in a freshly spawned
+# process so that its peak RSS is its own: a forked child would start out at the parent's
+# peak and report it for every small level. On Linux even ru_maxrss keeps the pre-exec
+# peak of a spawned child, so the peak is read from VmHWM, which belongs to the process's
+# own address space, where /proc has it. The medians are compared against a stored JSON baseline and
+# anything that got worse by more than --threshold is reported as a regression, e.g.
+#
+#    python benchmark.py --save            # record a new baseline
+#    python benchmark.py --threshold 0.2   # compare against it
+
+# benchmark name -> (solver.py search, heuristic); bfs is the draft BFS from bfsworking.py
+ALGORITHMS = {
+    'bfs': None,
+    'ucs': ('ucs', 'manhattan'),
+    'astar-manhattan': ('astar', 'manhattan'),
+    'astar-greedy': ('astar', 'greedy'),
+    'astar-matching': ('astar', 'matching'),
+    'astar-pdb': ('astar', 'pdb'),
+    'push-manhattan': ('push', 'manhattan'),
+    'push-greedy': ('push', 'greedy'),
+    'push-matching': ('push', 'matching'),
+    'push-pdb': ('push', 'pdb'),
+    'ida-matching': ('ida', 'matching'),
+    'ara-matching': ('ara', 'matching'),
+    'bidir': ('bidir', 'manhattan'),
+    'batch-manhattan': ('batch', 'manhattan'),
+    'batch-ucs': ('batch-ucs', 'manhattan'),
+}
+DEFAULT_ALGORITHMS = ['bfs', 'ucs', 'astar-manhattan', 'astar-greedy', 'astar-matching']
+DEFAULT_LEVELS = ['testcases', os.path.join('testcases', 'new')]
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# start method for the measured runs (see the comment at the top)
+SPAWN = multiprocessing.get_context('spawn')
+
+# metrics compared against the baseline, and whether a larger value is worse
+COMPARED = {'time': True, 'expanded': True, 'peak_rss_kb': True, 'nodes_per_sec': False}
+# metrics that are only compared when the baseline run took at least --min-time
+TIMED = ('time', 'nodes_per_sec')
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process in kB, or None where it cannot be read
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+
+
+def run_once(level, algorithm, conn):
+    """
+    Worker process body: solve one level once and send back its measurements
+    """
+    sys.stdout = open(os.devnull, 'w')  # bfsworking prints progress and the solution
+    start = time.perf_counter()
+    if ALGORITHMS[algorithm] is None:
+        output = bfsworking.SokobanMap(level).BFS()
+    else:
+        search, heuristic = ALGORITHMS[algorithm]
+        output = SokobanMap(level, heuristic).search(search)
+    wall = time.perf_counter() - start
+    rss = peak_rss_kb()
+    conn.send({'solved': bool(output), 'time': wall, 'expanded': output.expanded,
+               'length': len(output.solution) if output else None,
+               'peak_frontier': output.frontier_max, 'peak_rss_kb': rss})
+    conn.close()
+
+
+def measure(level, algorithm, timeout):
+    """
+    One timed run in a freshly spawned process
+    :return: measurement dict, or None if the run timed out or crashed
+    """
+    receiver, sender = SPAWN.Pipe(duplex=False)
+    process = SPAWN.Process(target=run_once, args=(level, algorithm, sender))
+    process.start()
+    sender.close()
+    result = None
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            pass
+    if process.is_alive():
+        process.terminate()
+    process.join()
+    receiver.close()
+    return result
+
+
+def benchmark(levels, algorithms, repeat, timeout, out=sys.stdout):
+    """
+    :return: {level: {algorithm: summary}} with the median of each metric over `repeat` runs,
+             or a status of 'timeout' / 'unsolved' in place of the metrics
+    """
+    results = {}
+    for level in levels:
+        results[level] = {}
+        for algorithm in algorithms:
+            runs = []
+            for i in range(repeat):
+                run = measure(level, algorithm, timeout)
+                if run is None:
+                    break
+                runs.append(run)
+            if len(runs) < repeat:
+                summary = {'status': 'timeout'}
+            elif not runs[0]['solved']:
+                summary = {'status': 'unsolved'}
+            else:
+                summary = {'status': 'solved', 'length': runs[0]['length']}
+                for metric in ('time', 'expanded', 'peak_frontier', 'peak_rss_kb'):
+                    values = [run[metric] for run in runs if run[metric] is not None]
+                    summary[metric] = statistics.median(values) if values else None
+                summary['nodes_per_sec'] = summary['expanded'] / summary['time'] if summary['time'] else None
+            results[level][algorithm] = summary
+            out.write('%-32s %-16s %s\n' % (level, algorithm, format_summary(summary)))
+            out.flush()
+    return results
+
+
+def format_summary(summary):
+    if summary['status'] != 'solved':
+        return summary['status']
+    return ('time %.4fs  expanded %d  %.0f nodes/s  peak frontier %s  peak rss %s KB'
+            % (summary['time'], summary['expanded'], summary['nodes_per_sec'] or 0,
+               summary['peak_frontier'], summary['peak_rss_kb']))
+
+
+def compare(results, baseline, threshold, min_time=0.0):
+    """
+    List every metric that is more than `threshold` (a fraction) worse than the baseline,
+    plus any run that is no longer solved. Timings of runs that took less than `min_time`
+    seconds in the baseline are mostly start-up noise and are not compared.
+    """
+    regressions = []
+    for level, by_algorithm in results.items():
+        for algorithm, summary in by_algorithm.items():
+            old = baseline.get(level, {}).get(algorithm)
+            if old is None:
+                continue
+            if old['status'] == 'solved' and summary['status'] != 'solved':
+                regressions.append('%s %s: was solved, now %s' % (level, algorithm, summary['status']))
+                continue
+            if summary['status'] != 'solved' or old['status'] != 'solved':
+                continue
+            for metric, larger_is_worse in COMPARED.items():
+                before = old.get(metric)
+                after = summary.get(metric)
+                if not before or after is None:
+                    continue
+                if metric in TIMED and old['time'] < min_time:
+                    continue
+                change = (after - before) / before
+                if not larger_is_worse:
+                    change = -change
+                if change > threshold:
+                    regressions.append('%s %s: %s %.4g -> %.4g (%+.0f%%)'
+                                       % (level, algorithm, metric, before, after, 100 * (after - before) / before))
+    return regressions
+
+
+def main(arglist):
+    """
+    Benchmark the solvers on every bundled level and check for regressions
+    :param arglist: command line arguments, see --help
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Sokoban solvers against a stored baseline.')
+    parser.add_argument('levels', nargs='*', default=DEFAULT_LEVELS,
+                        help='level files, directories or glob patterns (default: the bundled testcases)')
+    parser.add_argument('-a', '--algorithms', default=','.join(DEFAULT_ALGORITHMS),
+                        help='comma separated, from: ' + ', '.join(ALGORITHMS))
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per level and algorithm')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds allowed per run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='skip timing comparisons for runs faster than this in the baseline (seconds)')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional change that counts as a regression (default %(default)s)')
+    args = parser.parse_args(arglist)
+
+    algorithms = args.algorithms.split(',')
+    for algorithm in algorithms:
+        if algorithm not in ALGORITHMS:
+            parser.error('unknown algorithm ' + algorithm)
+    results = benchmark(find_levels(args.levels), algorithms, args.repeat, args.timeout)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print('baseline written to', args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline at', args.baseline, '- run with --save to create one')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.min_time)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    if not regressions:
+        print('no regressions past %.0f%%' % (100 * args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
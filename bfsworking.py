@@ -1,6 +1,11 @@
 import sys
 import time
 import copy
+import hashlib
+from collections import deque
+
+from board import Board, MOVES, DIRECTION
+from solver import SearchStats, FingerprintSet
 
 class SokobanMap:
     """
@@ -40,159 +45,61 @@ class SokobanMap:
         Build a Sokoban map instance from the given file name
         :param filename:
         """
-        f = open(filename, 'r')
+        self.board = Board.load(filename)
+        self.x_size = self.board.x_size
+        self.y_size = self.board.y_size
+        self.tgt_positions = self.board.positions(self.board.targets)
+        # the moving parts: box bitboard and player cell index on the board
+        self.boxes = self.board.boxes
+        self.player = self.board.player
 
-        rows = []
-        for line in f:
-            if len(line.strip()) > 0:
-                rows.append(list(line.strip()))
+        self.parent = parent  # parent node, a NODE! not just a matrix.
+        self.action = action  # The one that led to this node (useful for retracing purpose)
+        self.depth = depth  # depth of the node in the tree. This is the criterion for who's next in DFS, BFS.
 
-        f.close()
+    def __deepcopy__(self, memo):
+        # a node's state is two ints; the board (and the parent, replaced by BFS) are shared
+        node = copy.copy(self)
+        memo[id(self)] = node
+        return node
 
-        row_len = len(rows[0])
-        for row in rows:
-            assert len(row) == row_len, "Mismatch in row length"
+    @property
+    def box_positions(self):
+        return self.board.positions(self.boxes)
 
-        num_rows = len(rows)
+    @property
+    def player_position(self):
+        return self.board.position(self.player)
 
-        
-        box_positions = []
-        tgt_positions = []
-        player_position = None
-        
-        
-        for i in range(num_rows):
-            for j in range(row_len):
-                if rows[i][j] == self.BOX_SYMBOL:
-                    box_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.TGT_SYMBOL:
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_SYMBOL:
-                    player_position = (i, j)
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.BOX_ON_TGT_SYMBOL:
-                    box_positions.append((i, j))
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_ON_TGT_SYMBOL:
-                    player_position = (i, j)
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-
-        assert len(box_positions) == len(tgt_positions), "Number of boxes does not match number of targets"
-
-        self.x_size = row_len
-        self.y_size = num_rows
-        self.box_positions = box_positions
-        self.tgt_positions = tgt_positions
-        self.player_position = player_position
-        self.player_x = player_position[1]
-        self.player_y = player_position[0]
-        self.obstacle_map = rows
+    @property
+    def player_x(self):
+        return self.player_position[1]
+
+    @property
+    def player_y(self):
+        return self.player_position[0]
 
-        self.parent = parent  # parent node, a NODE! not just a matrix.
-        self.action = action  # The one that led to this node (useful for retracing purpose)
-        self.depth = depth  # depth of the node in the tree. This is the criterion for who's next in DFS, BFS.
-    
     def apply_move(self, move):
         """
         Apply a player move to the map.
         :param move: 'L', 'R', 'U' or 'D'
         :return: True if move was successful, false if move could not be completed
         """
-        
-        # basic obstacle check
-        if move == self.LEFT:
-            if self.obstacle_map[self.player_y][self.player_x - 1] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x - 1
-                new_y = self.player_y
-
-        elif move == self.RIGHT:
-            if self.obstacle_map[self.player_y][self.player_x + 1] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x + 1
-                new_y = self.player_y
-
-        elif move == self.UP:
-            if self.obstacle_map[self.player_y - 1][self.player_x] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x
-                new_y = self.player_y - 1
-
-        else:
-            if self.obstacle_map[self.player_y + 1][self.player_x] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x
-                new_y = self.player_y + 1
-
-        # pushed box collision check
-        if (new_y, new_x) in self.box_positions:
-            if move == self.LEFT:
-                if self.obstacle_map[new_y][new_x - 1] == self.OBSTACLE_SYMBOL or (new_y, new_x - 1) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x - 1
-                    new_box_y = new_y
-
-            elif move == self.RIGHT:
-                if self.obstacle_map[new_y][new_x + 1] == self.OBSTACLE_SYMBOL or (new_y, new_x + 1) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x + 1
-                    new_box_y = new_y
-
-            elif move == self.UP:
-                if self.obstacle_map[new_y - 1][new_x] == self.OBSTACLE_SYMBOL  or (new_y - 1, new_x) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x
-                    new_box_y = new_y - 1
-
-            else:
-                if self.obstacle_map[new_y + 1][new_x] == self.OBSTACLE_SYMBOL or (new_y + 1, new_x) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x
-                    new_box_y = new_y + 1
-
-            # update box position
-            self.box_positions.remove((new_y, new_x))
-            self.box_positions.append((new_box_y, new_box_x))
-
-        # update player position
-        self.player_x = new_x
-        self.player_y = new_y
-
+        state = self.board.move(self.boxes, self.player, DIRECTION[move])
+        if state is None:
+            return False
+        self.boxes, self.player = state
         return True
-    
+
     def get_state_wp(self):
-        states = self.tgt_positions.copy()
-        for i in self.box_positions:
-            states.append(i)
-        states.append((self.player_x, self.player_y))       
-        return tuple(states)
-    
+        return (self.boxes, self.player)
+
     def get_state(self):
-        states = self.tgt_positions.copy()
-        for i in self.box_positions:
-            states.append(i)     
-        return tuple(states)
-        
+        return self.boxes
+
     def goal_state(self):
-        states = self.tgt_positions.copy()
-        for i in self.tgt_positions:
-            states.append(i)     
-        return tuple(states)
-        
-  
-    
+        return self.board.targets
+
     def done(self, current_node):
         """ The prupose of this function  is: Trace back this node to the founding granpa.
         Print out the states through out
@@ -214,71 +121,71 @@ class SokobanMap:
                 i.render()
                 print('\n')
 
+    def solution(self, current_node):
+        """
+        Moves from the initial state to current_node
+        """
+        moves = []
+        while current_node.parent is not None:
+            moves.append(current_node.action)
+            current_node = current_node.parent
+        moves.reverse()
+        return moves
+
     def render(self):
         """
         Render the map's current state to terminal
         """
-        for r in range(self.y_size):
-            line = ''
-            for c in range(self.x_size):
-                symbol = self.FREE_GLYPH
-                if self.obstacle_map[r][c] == self.OBSTACLE_SYMBOL:
-                    symbol = self.OBST_GLYPH
-                if (r, c) in self.tgt_positions:
-                    symbol = self.TGT_GLYPH
-                # box or player overwrites tgt
-                if (r, c) in self.box_positions:
-                    symbol = self.BOX_GLYPH
-                if self.player_x == c and self.player_y == r:
-                    symbol = self.PLAYER_GLYPH
-                line += symbol
-            print(line)
-
-        print('\n\n')
+        self.board.render(self.boxes, self.player)
 
     def is_finished(self):
-        finished = True
-        for i in self.box_positions:
-            if i not in self.tgt_positions:
-                finished = False
-        return finished
-    
-    def explore_actions(self):     
-          possibilities = ['u', 'd', 'r', 'l']
-          actions = []
-          for apossibility in possibilities:
-              new_state = copy.deepcopy(self)
-              if(new_state.apply_move(apossibility)):
-                   actions.append(apossibility)
-          return actions
+        return self.board.is_finished(self.boxes)
+
+    def explore_actions(self):
+        """
+        Moves that are legal from this state, in expansion order
+        """
+        return [move for d, (move, dy, dx) in enumerate(MOVES)
+                if self.board.move(self.boxes, self.player, d) is not None]
     
-    def BFS(self):
-        start = time.time()
+    def BFS(self, progress=None, progress_interval=1.0, explored_backend='set', bloom_bits=0):
+        """
+        Breadth-first search from this map's state
+        :param progress: optional stream for JSON-lines progress reports (see solver.SearchStats)
+        :param explored_backend: 'set' keeps the full state tuples; 'fingerprint' keeps only a
+                                 64-bit hash of each state in a solver.FingerprintSet
+        :param bloom_bits: Bloom filter size for the fingerprint backend, 0 for none
+        :return: SearchStats, truthy if the goal was reached
+        """
+        if explored_backend == 'fingerprint':
+            return self.BFS_fingerprint(progress, progress_interval, bloom_bits)
+        stats = SearchStats('bfs', progress, progress_interval)
         frontier = [self]  # queue of found but unvisited nodes, FIFO
-        frontier_max_size = len(frontier)  # We measure space / memory requirements of the algo via this metric.
+        stats.frontier_max = len(frontier)  # We measure space / memory requirements of the algo via this metric.
         ft = set()
         ft.add(self.get_state_wp())
         explored = set([])
-        ct = 0
         
         while frontier:
-            ct += 1
-            print(ct, end='\r')
-            if len(frontier) > frontier_max_size: frontier_max_size = len(frontier)
+            print(stats.expanded + 1, end='\r')
+            if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
 
             current_node = frontier.pop(0) # select and remove the first node in the queue
 
             ft.remove(tuple(current_node.get_state_wp()))
             explored.add(tuple(current_node.get_state_wp()))
-            
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(frontier), current_node.depth)
             
             
             if (current_node.is_finished()):
-                print('Time required = ', -start + time.time())
+                stats.explored = len(explored)
+                print('Time required = ', time.perf_counter() - stats.start)
                 print('Explored states = ', len(explored))
-                print('Frontier max size = ', frontier_max_size)
+                print('Frontier max size = ', stats.frontier_max)
                 self.done(current_node)
-                return True
+                return stats.finish(self.solution(current_node), len(frontier))
             
             actions = current_node.explore_actions()
 
@@ -288,14 +195,73 @@ class SokobanMap:
                 new_node.depth += 1
                 new_node.parent = current_node
                 new_node.action = anaction
+                stats.generated += 1
 
                 if tuple(new_node.get_state_wp()) not in explored:
                     if tuple(new_node.get_state_wp()) not in ft:
                         frontier.append(new_node)
                         ft.add(tuple(new_node.get_state_wp()))
+                        continue
+                stats.duplicates += 1
                                     
-        print('Failed to reach target goal. Number of states explored = ')
-        return len(explored) 
+        print('Failed to reach target goal. Number of states explored = ', len(explored))
+        stats.explored = len(explored)
+        return stats.finish(None, 0)
+
+    def BFS_fingerprint(self, progress=None, progress_interval=1.0, bloom_bits=0):
+        """
+        BFS keeping one fingerprint per state seen (explored or queued) instead of the state
+        tuples; two states with the same fingerprint are taken for one, with the reported
+        collision_probability
+        """
+        stats = SearchStats('bfs', progress, progress_interval)
+        frontier = deque([self])
+        stats.frontier_max = len(frontier)
+        seen = FingerprintSet(bloom_bits=bloom_bits)
+        seen.add(self.fingerprint())
+
+        while frontier:
+            if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
+
+            current_node = frontier.popleft()
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(frontier), current_node.depth)
+
+            if (current_node.is_finished()):
+                stats.explored = len(seen) - len(frontier)
+                stats.collision_probability = seen.collision_probability()
+                print('Time required = ', time.perf_counter() - stats.start)
+                print('Explored states = ', stats.explored)
+                print('Frontier max size = ', stats.frontier_max)
+                self.done(current_node)
+                return stats.finish(self.solution(current_node), len(frontier))
+
+            for anaction in current_node.explore_actions():
+                new_node = copy.deepcopy(current_node)
+                new_node.apply_move(anaction)
+                new_node.depth += 1
+                new_node.parent = current_node
+                new_node.action = anaction
+                stats.generated += 1
+                if seen.add(new_node.fingerprint()):
+                    frontier.append(new_node)
+                else:
+                    stats.duplicates += 1
+
+        print('Failed to reach target goal. Number of states explored = ', len(seen))
+        stats.explored = len(seen)
+        stats.collision_probability = seen.collision_probability()
+        return stats.finish(None, 0)
+
+    def fingerprint(self):
+        """
+        64-bit hash of get_state_wp. Not hash(): ints hash modulo 2**61 - 1, so bitboards
+        that differ by a box 61 cells along would always collide.
+        """
+        state = (self.boxes << self.board.size.bit_length()) | self.player
+        digest = hashlib.blake2b(state.to_bytes((state.bit_length() + 7) // 8, 'little'), digest_size=8)
+        return int.from_bytes(digest.digest(), 'little')
                             
                 
 def main(arglist):
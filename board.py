@@ -0,0 +1,174 @@
+import sys
+
+# Flat bitboard representation of a Sokoban level, shared by the interactive game
+# (sokoban_map.py), the solvers (solver.py, bfsworking.py) and the replay tools
+# (SokobanMap.replay).
+#
+# The level is stored row by row in one 1D array, padded with a border of walls so that
+# a step off any cell lands on a valid index. A cell is an int index, and stepping in
+# direction d adds offsets[d]. Walls are a bytearray with one byte per cell. Boxes and
+# targets are int bitboards with one bit per cell. So every wall, box and target check is
+# O(1), a push is two bit flips, and a level is solved exactly when boxes == targets.
+
+# input file symbols
+BOX_SYMBOL = 'B'
+TGT_SYMBOL = 'T'
+PLAYER_SYMBOL = 'P'
+OBSTACLE_SYMBOL = '#'
+FREE_SPACE_SYMBOL = ' '
+BOX_ON_TGT_SYMBOL = 'b'
+PLAYER_ON_TGT_SYMBOL = 'p'
+
+# (move, dy, dx) in expansion order; the opposite of direction d is d ^ 1
+MOVES = (('u', -1, 0), ('d', 1, 0), ('r', 0, 1), ('l', 0, -1))
+DIRECTION = {move: d for d, (move, dy, dx) in enumerate(MOVES)}
+
+# render characters
+FREE_GLYPH = '   '
+OBST_GLYPH = 'XXX'
+BOX_GLYPH = '[B]'
+TGT_GLYPH = '(T)'
+PLAYER_GLYPH = '<P>'
+
+
+class Board:
+    """
+    Walls and targets of a level on a flat padded grid. The moving parts of a state
+    (a box bitboard and a player index) are kept by the caller and passed in.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: the level as lists of symbols, all of one length
+        """
+        self.x_size = len(rows[0])
+        self.y_size = len(rows)
+        self.width = self.x_size + 2
+        self.size = self.width * (self.y_size + 2)
+        self.offsets = tuple(dy * self.width + dx for (move, dy, dx) in MOVES)
+        self.walls = bytearray(b'\x01') * self.size
+        self.targets = 0
+        self.boxes = 0  # initial box bitboard
+        self.player = None  # initial player index
+        for y, row in enumerate(rows):
+            for x, symbol in enumerate(row):
+                i = self.index(y, x)
+                if symbol != OBSTACLE_SYMBOL:
+                    self.walls[i] = 0
+                if symbol in (TGT_SYMBOL, BOX_ON_TGT_SYMBOL, PLAYER_ON_TGT_SYMBOL):
+                    self.targets |= 1 << i
+                if symbol in (BOX_SYMBOL, BOX_ON_TGT_SYMBOL):
+                    self.boxes |= 1 << i
+                if symbol in (PLAYER_SYMBOL, PLAYER_ON_TGT_SYMBOL):
+                    self.player = i
+        assert bin(self.boxes).count('1') == bin(self.targets).count('1'), \
+            "Number of boxes does not match number of targets"
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a level file (one row per non-blank line)
+        """
+        rows = []
+        with open(filename, 'r') as f:
+            for line in f:
+                if len(line.strip()) > 0:
+                    rows.append(list(line.strip()))
+        row_len = len(rows[0])
+        for row in rows:
+            assert len(row) == row_len, "Mismatch in row length"
+        return cls(rows)
+
+    def index(self, y, x):
+        return (y + 1) * self.width + x + 1
+
+    def position(self, i):
+        """
+        (y, x) of a cell index, the inverse of index
+        """
+        y, x = divmod(i, self.width)
+        return y - 1, x - 1
+
+    def bitboard(self, positions):
+        """
+        Bitboard of a collection of (y, x) positions
+        """
+        bits = 0
+        for y, x in positions:
+            bits |= 1 << self.index(y, x)
+        return bits
+
+    def positions(self, bits):
+        """
+        (y, x) of every cell set in a bitboard, in index (row-major) order
+        """
+        result = []
+        while bits:
+            low = bits & -bits
+            result.append(self.position(low.bit_length() - 1))
+            bits ^= low
+        return result
+
+    def floor(self):
+        """
+        Indices of all non-wall cells, in row-major order
+        """
+        return [i for i in range(self.size) if not self.walls[i]]
+
+    def move(self, boxes, player, d):
+        """
+        One player step in direction d, pushing a box if there is one in the way
+        :return: (boxes, player) after the step, or None if it is blocked
+        """
+        step = self.offsets[d]
+        new = player + step
+        if self.walls[new]:
+            return None
+        if (boxes >> new) & 1:
+            ahead = new + step
+            if self.walls[ahead] or (boxes >> ahead) & 1:
+                return None
+            boxes ^= (1 << new) | (1 << ahead)
+        return boxes, new
+
+    def is_finished(self, boxes):
+        return boxes == self.targets
+
+    def replay(self, moves, boxes=None, player=None):
+        """
+        True if the moves, applied one by one from the given state (by default the
+        level's initial state), are all legal and leave every box on a target
+        """
+        if boxes is None:
+            boxes, player = self.boxes, self.player
+        for move in moves:
+            state = self.move(boxes, player, DIRECTION[move])
+            if state is None:
+                return False
+            boxes, player = state
+        return self.is_finished(boxes)
+
+    def render(self, boxes, player, out=None):
+        """
+        Draw a state to the terminal
+        :param out: stream to write to, by default sys.stdout at the time of the call
+        """
+        if out is None:
+            out = sys.stdout
+        for y in range(self.y_size):
+            line = ''
+            for x in range(self.x_size):
+                i = self.index(y, x)
+                symbol = FREE_GLYPH
+                if self.walls[i]:
+                    symbol = OBST_GLYPH
+                if (self.targets >> i) & 1:
+                    symbol = TGT_GLYPH
+                # box or player overwrites tgt
+                if (boxes >> i) & 1:
+                    symbol = BOX_GLYPH
+                if i == player:
+                    symbol = PLAYER_GLYPH
+                line += symbol
+            out.write(line + '\n')
+        out.write('\n\n\n')
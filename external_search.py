@@ -0,0 +1,216 @@
+import os
+import zlib
+import time
+import heapq
+import shutil
+import struct
+import tempfile
+
+# External-memory breadth-first search over single player steps.
+#
+# Nothing grows with the state space in RAM: every BFS layer, and the set of all states
+# explored so far, is a sorted run file of fixed-width states on disk, written as
+# zlib-compressed blocks. Expanding a layer streams it from disk; children are collected in
+# a bounded buffer that is sorted, de-duplicated and spilled as a run whenever it fills.
+# Duplicate detection is a sequential merge: the spilled runs are merged together and
+# the explored run is subtracted from them, giving the next layer, which is then merged
+# into the explored run. The solution is recovered by scanning the layer files backwards
+# for a parent of each state on the path.
+#
+# A state is the packed box bitmask followed by the player cell (see SokobanMap.state_key),
+# stored big-endian so that byte order is numeric order.
+
+BLOCK_STATES = 4096  # states per compressed block
+BLOCK_HEADER = struct.Struct('<I')  # compressed length of the block that follows
+DEFAULT_SPILL_STATES = 1 << 20
+
+
+def write_run(path, states, width):
+    """
+    Write sorted, unique states (ints) to a run file
+    :return: number of states written
+    """
+    count = 0
+    block = []
+    with open(path, 'wb') as f:
+        for state in states:
+            block.append(state.to_bytes(width, 'big'))
+            if len(block) == BLOCK_STATES:
+                data = zlib.compress(b''.join(block), 1)
+                f.write(BLOCK_HEADER.pack(len(data)) + data)
+                count += len(block)
+                block = []
+        if block:
+            data = zlib.compress(b''.join(block), 1)
+            f.write(BLOCK_HEADER.pack(len(data)) + data)
+            count += len(block)
+    return count
+
+
+def read_run(path, width):
+    """
+    Yield the states of a run file in order, holding one block in memory at a time
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if not header:
+                return
+            data = zlib.decompress(f.read(BLOCK_HEADER.unpack(header)[0]))
+            for i in range(0, len(data), width):
+                yield int.from_bytes(data[i:i + width], 'big')
+
+
+def merge_unique(runs):
+    """
+    Merge sorted iterables into one sorted stream without duplicates
+    """
+    last = None
+    for state in heapq.merge(*runs):
+        if state != last:
+            yield state
+            last = state
+
+
+def difference(states, exclude):
+    """
+    Sorted, unique states that are not in the sorted iterable `exclude`
+    """
+    exclude = iter(exclude)
+    current = next(exclude, None)
+    for state in states:
+        while current is not None and current < state:
+            current = next(exclude, None)
+        if state != current:
+            yield state
+
+
+def successors(map_inst, state):
+    """
+    Yield (direction, child state) for every legal player step, skipping pushes onto dead
+    squares and pushes that freeze a box off target (as apply_move does)
+    """
+    bits = map_inst.player_bits
+    boxes = state >> bits
+    player = state & ((1 << bits) - 1)
+    neighbours = map_inst.neighbours
+    for d, n in enumerate(neighbours[player]):
+        if n < 0:
+            continue
+        if (boxes >> n) & 1:
+            ahead = neighbours[n][d]
+            if ahead < 0 or (boxes >> ahead) & 1:
+                continue
+            if map_inst.dead[ahead]:
+                map_inst.pruned_dead += 1
+                continue
+            new_boxes = boxes ^ (1 << n) | (1 << ahead)
+            if map_inst.freeze_deadlock(new_boxes, ahead):
+                map_inst.pruned_frozen += 1
+                continue
+            yield d, (new_boxes << bits) | n
+        else:
+            yield d, (boxes << bits) | n
+
+
+def layered_bfs(map_inst, stats, directory=None, spill_states=DEFAULT_SPILL_STATES):
+    """
+    External-memory BFS from the map's initial state, filling in stats as it goes. When the
+    search is profiled (stats.phase_time is set), generating successors is timed as 'moves'
+    and the sorting, merging and subtracting of runs that finds duplicates as 'hashing';
+    there is no heuristic.
+    :param directory: where the run files go (a temporary directory inside it is used and
+                      removed afterwards); None for the system default
+    :param spill_states: children held in memory before they are sorted and spilled
+    :return: shortest list of moves, or None if the level cannot be solved
+    """
+    phase_time = stats.phase_time
+    clock = time.perf_counter
+    width = (len(map_inst.cells) + map_inst.player_bits + 7) // 8
+    bits = map_inst.player_bits
+    goal = map_inst.tgt_bits
+    root = map_inst.state_key(map_inst.box_positions, map_inst.player_position)
+    work = tempfile.mkdtemp(prefix='sokoban-bfs-', dir=directory)
+    try:
+        layers = [os.path.join(work, 'layer0')]
+        write_run(layers[0], [root], width)
+        explored = os.path.join(work, 'explored0')
+        stats.explored = write_run(explored, [root], width)
+        size = 1
+        while size:
+            depth = len(layers) - 1
+            stats.frontier_max = max(stats.frontier_max, size)
+            runs = []
+            buffer = []
+            generated = 0
+            for state in read_run(layers[depth], width):
+                stats.expanded += 1
+                if not stats.expanded & (stats.CHECK_EVERY - 1):
+                    stats.checkpoint(size, depth)
+                if state >> bits == goal:
+                    return trace(map_inst, layers, state, width)
+                if phase_time is not None:
+                    began = clock()
+                for d, child in successors(map_inst, state):
+                    buffer.append(child)
+                    generated += 1
+                if phase_time is not None:
+                    phase_time['moves'] += clock() - began
+                if len(buffer) >= spill_states:
+                    began = clock()
+                    runs.append(spill(work, len(runs), buffer, width))
+                    buffer = []
+                    if phase_time is not None:
+                        phase_time['hashing'] += clock() - began
+            began = clock()
+            if buffer:
+                runs.append(spill(work, len(runs), buffer, width))
+
+            # next layer: children not explored before; then fold it into the explored run
+            layers.append(os.path.join(work, 'layer%d' % (depth + 1)))
+            children = merge_unique([read_run(run, width) for run in runs])
+            size = write_run(layers[-1], difference(children, read_run(explored, width)), width)
+            stats.generated += generated
+            stats.duplicates += generated - size
+            merged = os.path.join(work, 'explored%d' % (depth + 1))
+            stats.explored = write_run(merged, merge_unique([read_run(explored, width),
+                                                             read_run(layers[-1], width)]), width)
+            os.remove(explored)
+            explored = merged
+            for run in runs:
+                os.remove(run)
+            if phase_time is not None:
+                phase_time['hashing'] += clock() - began
+        return None
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def spill(work, index, buffer, width):
+    """
+    Sort and de-duplicate a buffer of child states into run file number `index`
+    """
+    path = os.path.join(work, 'run%d' % index)
+    buffer.sort()
+    write_run(path, merge_unique([buffer]), width)
+    return path
+
+
+def trace(map_inst, layers, state, width):
+    """
+    Rebuild the moves to `state`, found in the last layer, by finding a parent of each
+    state on the path in the layer before it
+    """
+    pruned = (map_inst.pruned_dead, map_inst.pruned_frozen)
+    moves = []
+    for layer in reversed(layers[:-1]):
+        for parent in read_run(layer, width):
+            move = next((d for d, child in successors(map_inst, parent) if child == state), None)
+            if move is not None:
+                moves.append(map_inst.MOVES[move][0])
+                state = parent
+                break
+    moves.reverse()
+    # re-expanding the layers should not count as more pruning
+    map_inst.pruned_dead, map_inst.pruned_frozen = pruned
+    return moves
@@ -0,0 +1,255 @@
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+
+from solver import SokobanMap, Node, BucketQueue, SearchStats
+
+# Hash-distributed A* (HDA*) for a single hard level.
+#
+# Every worker process owns the states whose Zobrist hash falls in its partition
+# (zkey % workers) and keeps the open and closed lists for those states only. Expanding a
+# node sends each child to its owner; children are collected per owner and shipped as one
+# batch per expansion round. The sender, which holds the parent, updates each child's
+# heuristic incrementally (SokobanMap.update_heuristic) and ships the value and its cache
+# along, so the owner never recomputes a heuristic from scratch. A worker is idle once it has nothing queued with f below the
+# best solution cost found so far, and the search is over when every worker is idle and
+# every batch sent has been received.
+
+# nodes a worker expands between flushing its outgoing batches
+EXPANSION_BATCH = 64
+INFINITY = 2 ** 62
+
+
+def worker(index, filename, heuristic, inboxes, results, incumbent, goal_key, idle, sent, received):
+    """
+    Body of one HDA* worker process
+    :param index: this worker's partition
+    :param inboxes: one multiprocessing.Queue per worker; messages are ('nodes', batch),
+                    ('trace', zkey) or ('stop',), where a batch is a list of (zkey, g, boxes,
+                    player, parent zkey, action, heuristic, heuristic cache)
+    :param results: queue for replies to the coordinator
+    :param incumbent: shared cost of the best solution found so far (INFINITY if none)
+    :param goal_key: shared Zobrist key of that solution's final state
+    :param idle: shared per-worker idle flags
+    :param sent, received: shared per-worker counts of node batches sent and processed
+    """
+    map_inst = SokobanMap(filename, heuristic)
+    workers = len(inboxes)
+    inbox = inboxes[index]
+    open_list = BucketQueue()
+    closed = {}  # zkey -> (best g, parent zkey, action) for every state this worker owns
+    outboxes = [[] for i in range(workers)]
+    expanded = 0
+    generated = 0
+    duplicates = 0
+    actions = ['u', 'd', 'r', 'l']
+
+    def receive(batch):
+        nonlocal duplicates
+        for (zkey, g, boxes, player, parent_key, action, heuristic, h_cache) in batch:
+            entry = closed.get(zkey)
+            if entry is not None and entry[0] <= g:
+                duplicates += 1
+                continue
+            closed[zkey] = (g, parent_key, action)
+            node = Node(None, action, g)
+            node.boxes = boxes
+            node.player = player
+            node.zkey = zkey
+            node.heuristic = heuristic
+            node.h_cache = h_cache
+            open_list.push(node, g + heuristic, heuristic)
+
+    while True:
+        # handle everything waiting in the inbox; block briefly when there is nothing else to do
+        while True:
+            try:
+                message = inbox.get(timeout=0.01) if idle[index] else inbox.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'nodes':
+                idle[index] = 0
+                receive(message[1])
+                with received.get_lock():
+                    received[index] += 1
+            elif message[0] == 'trace':
+                g, parent_key, action = closed[message[1]]
+                results.put(('trace', message[1], parent_key, action))
+            else:
+                results.put(('stats', index, expanded, generated, duplicates, len(open_list), len(closed)))
+                return
+
+        best = incumbent.value
+        blocked = False
+        for i in range(EXPANSION_BATCH):
+            if not open_list:
+                break
+            node = open_list.pop()
+            f = node.depth + node.heuristic
+            if f >= best:
+                # nothing left here can beat the incumbent
+                open_list.push(node, f, node.heuristic)
+                blocked = True
+                break
+            if closed[node.zkey][0] < node.depth:
+                continue
+            if map_inst.is_finished(node):
+                with incumbent.get_lock():
+                    if node.depth < incumbent.value:
+                        incumbent.value = node.depth
+                        goal_key.value = node.zkey
+                best = incumbent.value
+                continue
+            expanded += 1
+            for anaction in actions:
+                new_node = Node(node, anaction, node.depth + 1)
+                new_node.populateChild(node)
+                if map_inst.apply_move(anaction, new_node):
+                    generated += 1
+                    map_inst.update_heuristic(new_node)
+                    if map_inst.unsolvable(new_node):
+                        continue
+                    outboxes[new_node.zkey % workers].append(
+                        (new_node.zkey, new_node.depth, new_node.boxes, new_node.player,
+                         node.zkey, anaction, new_node.heuristic, new_node.h_cache))
+
+        for owner in range(workers):
+            batch = outboxes[owner]
+            if not batch:
+                continue
+            if owner == index:
+                receive(batch)
+            else:
+                # counted before it is queued, so sent can never lag behind received
+                with sent.get_lock():
+                    sent[index] += 1
+                inboxes[owner].put(('nodes', batch))
+            outboxes[owner] = []
+
+        if (not open_list or blocked) and inbox.empty():
+            idle[index] = 1
+
+
+def finished(idle, sent, received):
+    """
+    Termination test: every worker idle and every node batch sent has been processed, with
+    the counters unchanged across the idle check
+    """
+    before = (sum(sent[:]), sum(received[:]))
+    if not all(idle[:]):
+        return False
+    after = (sum(sent[:]), sum(received[:]))
+    return before == after and before[0] == before[1]
+
+
+def hda_star(filename, workers, heuristic='manhattan'):
+    """
+    Solve one level with HDA* over `workers` processes.
+    :return: SearchStats like SokobanMap.Astar; frontier and explored are summed over the workers,
+             and frontier_max is the frontier left at the end, as the workers' peaks are not tracked
+    """
+    stats = SearchStats('hda')
+    map_inst = SokobanMap(filename, heuristic)
+    root = map_inst.rootNode
+    map_inst.calc_heuristicAstar(root)
+    if map_inst.unsolvable(root):
+        return stats.finish(None, 0)
+    inboxes = [multiprocessing.Queue() for i in range(workers)]
+    results = multiprocessing.Queue()
+    incumbent = multiprocessing.Value('q', INFINITY)
+    goal_key = multiprocessing.Value('Q', 0)
+    idle = multiprocessing.Array('b', workers)
+    sent = multiprocessing.Array('q', workers + 1)  # the last slot counts the coordinator's root batch
+    received = multiprocessing.Array('q', workers)
+    processes = [multiprocessing.Process(target=worker, args=(i, filename, heuristic, inboxes, results, incumbent,
+                                                              goal_key, idle, sent, received))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    sent[workers] = 1
+    inboxes[root.zkey % workers].put(('nodes', [(root.zkey, 0, root.boxes, root.player,
+                                                 None, None, root.heuristic, root.h_cache)]))
+    while not finished(idle, sent, received):
+        for process in processes:
+            if not process.is_alive():
+                for other in processes:
+                    other.terminate()
+                raise RuntimeError('HDA* worker exited with code %s' % process.exitcode)
+        time.sleep(0.005)
+
+    solution = None
+    if incumbent.value < INFINITY:
+        # follow parent keys back through their owners
+        moves = []
+        key = goal_key.value
+        while key is not None:
+            inboxes[key % workers].put(('trace', key))
+            kind, traced, key, action = results.get()
+            if action is not None:
+                moves.append(action)
+        moves.reverse()
+        solution = moves
+
+    for inbox in inboxes:
+        inbox.put(('stop',))
+    frontier = 0
+    for i in range(workers):
+        kind, index, expanded, generated, duplicates, worker_frontier, explored = results.get()
+        stats.expanded += expanded
+        stats.generated += generated
+        stats.duplicates += duplicates
+        stats.explored += explored
+        frontier += worker_frontier
+    for process in processes:
+        process.join()
+
+    stats.frontier_max = frontier
+    return stats.finish(solution, frontier)
+
+
+def scaling(filename, worker_counts, heuristic='manhattan'):
+    """
+    Print HDA* time and speedup over single-threaded SokobanMap.Astar for each worker count,
+    along with the solution lengths, which must all match.
+    """
+    baseline = SokobanMap(filename, heuristic).Astar()
+    if not baseline:
+        print("Solution not found")
+        return
+    print('Astar: time = %.3f expanded = %d length = %d' % (baseline.time, baseline.expanded, len(baseline.solution)))
+    for workers in worker_counts:
+        output = hda_star(filename, workers, heuristic)
+        print('HDA* workers = %d: time = %.3f speedup = %.2f expanded = %d length = %d'
+              % (workers, output.time, baseline.time / output.time, output.expanded, len(output.solution)))
+        assert len(output.solution) == len(baseline.solution), "HDA* solution length differs from Astar"
+
+
+def main(arglist):
+    """
+    Solve one map file with HDA*, printing output in the same format as solver.py
+    :param arglist: command line arguments, see --help
+    """
+    parser = argparse.ArgumentParser(description='Solve a Sokoban map file with hash-distributed A*.')
+    parser.add_argument('map_file')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--heuristic', choices=['manhattan', 'greedy', 'matching', 'pdb'], default='manhattan')
+    parser.add_argument('--scaling', metavar='COUNTS',
+                        help='comma separated worker counts to compare against single-threaded Astar')
+    args = parser.parse_args(arglist)
+
+    if args.scaling:
+        scaling(args.map_file, [int(n) for n in args.scaling.split(',')], args.heuristic)
+        return
+    output = hda_star(args.map_file, args.workers, args.heuristic)
+    if output:
+        print(output.solution)
+        print([output.expanded + output.frontier, output.frontier, output.expanded, output.time])
+    else:
+        print("Solution not found")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
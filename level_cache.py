@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import zlib
+import base64
+import struct
+import hashlib
+from array import array
+
+import pattern_db
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # cell distances are decoded into array('H') rows, as SokobanMap builds them
+
+# On-disk cache of solved levels and per-map precomputation.
+#
+# Solutions (with their search statistics) are keyed by a canonical hash of the whole level
+# (walls, targets, boxes and player) plus the search and heuristic that produced them. The
+# distance tables only depend on the walls and targets, so they are keyed by the layout
+# hash alone and shared between levels on the same board; the all-pairs cell distances are
+# stored as zlib-compressed little-endian uint16s, base64 encoded. Entries are small JSON files;
+# once the directory grows past its size limit the least recently used files are removed.
+
+
+DEFAULT_DIR = 'level_cache'
+DEFAULT_SIZE = 64 * 1024 * 1024
+
+
+def level_digest(map_inst):
+    """
+    SHA-1 of a level: its layout (see pattern_db.layout_digest), boxes and player
+    """
+    h = hashlib.sha1(pattern_db.layout_digest(map_inst))
+    for box in sorted(map_inst.box_positions):
+        h.update(struct.pack('<HH', *box))
+    h.update(struct.pack('<HH', *map_inst.player_position))
+    return h.digest()
+
+
+def encode_cell_dist(cell_dist):
+    """
+    Pack SokobanMap.cell_dist (a uint16 NumPy array or a list of array('H') rows) for JSON
+    """
+    if isinstance(cell_dist, list):
+        data = array('H')
+        for row in cell_dist:
+            data.extend(row)
+        if sys.byteorder != 'little':
+            data.byteswap()
+        data = data.tobytes()
+    else:
+        data = cell_dist.astype('<u2').tobytes()
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+
+def decode_cell_dist(text, n):
+    """
+    Unpack encode_cell_dist's text into an (n, n) uint16 array, or without NumPy a list of
+    array('H') rows
+    """
+    data = zlib.decompress(base64.b64decode(text))
+    if np is not None:
+        return np.frombuffer(data, dtype='<u2').astype(np.uint16).reshape(n, n)
+    data = array('H', data)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return [data[i:i + n] for i in range(0, n * n, n)]
+
+
+class LevelCache:
+    """
+    Directory of cached solutions and distance tables with size-based LRU eviction.
+    A hit refreshes the file's modification time, which is what eviction orders by.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, name):
+        """
+        :return: the decoded entry, or None if it is missing or unreadable
+        """
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def write(self, name, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        partial = '%s.%d.tmp' % (path, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump(value, f)
+        os.replace(partial, path)  # readers never see a half-written entry
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the directory fits in max_bytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue  # removed by another process in the meantime
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def get_tables(self, map_inst):
+        """
+        :return: (push_dist, dead, cell_dist) as SokobanMap builds them at load, or None
+                 (also for entries written before cell_dist was stored)
+        """
+        value = self.read('%s.tables.json' % pattern_db.layout_digest(map_inst).hex())
+        if value is None or len(value['dead']) != len(map_inst.cells) or 'cell_dist' not in value:
+            return None
+        cell_dist = value['cell_dist']
+        if cell_dist is not None:
+            cell_dist = decode_cell_dist(cell_dist, len(map_inst.cells))
+        return value['push_dist'], bytearray(value['dead']), cell_dist
+
+    def put_tables(self, map_inst, tables):
+        push_dist, dead, cell_dist = tables
+        self.write('%s.tables.json' % pattern_db.layout_digest(map_inst).hex(),
+                   {'push_dist': push_dist, 'dead': list(dead),
+                    'cell_dist': encode_cell_dist(cell_dist) if cell_dist is not None else None})
+
+    def solution_name(self, map_inst, algorithm):
+        return '%s.%s-%s.solution.json' % (level_digest(map_inst).hex(), algorithm, map_inst.heuristic_name)
+
+    def get_solution(self, map_inst, algorithm):
+        """
+        :return: the SearchStats.as_dict of an earlier search of this level, or None
+        """
+        return self.read(self.solution_name(map_inst, algorithm))
+
+    def put_solution(self, map_inst, algorithm, fields):
+        self.write(self.solution_name(map_inst, algorithm), fields)
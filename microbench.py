@@ -0,0 +1,230 @@
+import gc
+import sys
+import time
+import random
+import argparse
+
+from solver import SokobanMap, Node, BucketQueue, TranspositionTable
+from batch_solver import find_levels
+
+# Microbenchmarks for the primitives in the solver's inner loop.
+#
+# End-to-end timings (benchmark.py) say that a search got slower, not which primitive did.
+# Each operation here is timed on states sampled from a real A* trace of the level, so the
+# box layouts, player positions and heuristic caches are the ones the search actually sees:
+#
+#    python microbench.py testcases/new/3box_m2.txt --samples 5000
+#
+# ns/op is the fastest of --repeat passes with the cost of the bare loop subtracted.
+# retained blocks/op is the net number of memory blocks an operation leaves allocated (the
+# objects it creates and keeps, e.g. a new packed state int), from sys.getallocatedblocks;
+# temporaries that are freed again before the pass ends do not show up in it.
+
+OPERATIONS = ('apply_move', 'zobrist_key', 'table_improve', 'calc_heuristicAstar', 'populateChild',
+              'is_finished', 'frontier_push', 'frontier_pop')
+ACTIONS = ['u', 'd', 'r', 'l']
+
+
+def trace_states(map_inst, limit):
+    """
+    Run A* from the root for at most `limit` expansions, as SokobanMap.Astar does
+    :return: the expanded nodes, in expansion order
+    """
+    root = map_inst.rootNode
+    map_inst.calc_heuristicAstar(root)
+    frontier = BucketQueue()
+    frontier.push(root, root.heuristic, root.heuristic)
+    best = {root.zkey: 0}
+    expanded = []
+    while frontier and len(expanded) < limit:
+        node = frontier.pop()
+        if best[node.zkey] < node.depth:
+            continue
+        expanded.append(node)
+        if map_inst.is_finished(node):
+            break
+        for action in ACTIONS:
+            child = Node(node, action, node.depth + 1)
+            child.populateChild(node)
+            if map_inst.apply_move(action, child) and best.get(child.zkey, child.depth + 1) > child.depth:
+                best[child.zkey] = child.depth
+                map_inst.update_heuristic(child)
+                if not map_inst.unsolvable(child):
+                    frontier.push(child, child.depth + child.heuristic, child.heuristic)
+    return expanded
+
+
+def sample_states(map_inst, count, seed=0):
+    """
+    `count` nodes drawn uniformly (with a fixed seed) from a search trace of the level
+    """
+    states = trace_states(map_inst, 20 * count)
+    rng = random.Random(seed)
+    return rng.sample(states, min(count, len(states)))
+
+
+def operation(map_inst, name, samples):
+    """
+    Build the inputs for one pass of an operation
+    :return: (run, items) where run(items) performs the operation once per item; fresh inputs
+             are built for every pass, since some operations modify their node
+    """
+    if name == 'apply_move':
+        items = []
+        for node in samples:
+            for action in ACTIONS:
+                child = Node(node, action, node.depth + 1)
+                child.populateChild(node)
+                items.append((action, child))
+
+        def run(items, apply_move=map_inst.apply_move):
+            for action, child in items:
+                apply_move(action, child)
+        return run, items
+
+    if name in ('zobrist_key', 'table_improve'):
+        # the children A* keys and looks up: every legal move from the sampled states
+        children = []
+        for node in samples:
+            for action in ACTIONS:
+                child = Node(node, action, node.depth + 1)
+                child.populateChild(node)
+                if map_inst.apply_move(action, child):
+                    children.append((node, child))
+
+        if name == 'zobrist_key':
+            # the incremental update apply_move makes to the parent's key for one move
+            items = children
+
+            def run(items, box=map_inst.zobrist_box, player=map_inst.zobrist_player):
+                for node, child in items:
+                    key = node.zkey ^ player[node.player] ^ player[child.player]
+                    if child.pushed is not None:
+                        key ^= box[child.pushed[0]] ^ box[child.pushed[1]]
+            return run, items
+
+        # the explored-set check A* makes for every child, on a table already holding the parents
+        table = TranspositionTable(map_inst.table_size(map_inst.tt_size))
+        for node in samples:
+            table.improve(node.zkey, node.depth)
+        items = [(child.zkey, child.depth) for node, child in children]
+
+        def run(items, improve=table.improve):
+            for key, g in items:
+                improve(key, g)
+        return run, items
+
+    if name == 'populateChild':
+        items = [(Node(node, 'u', node.depth + 1), node) for node in samples]
+
+        def run(items):
+            for child, node in items:
+                child.populateChild(node)
+        return run, items
+
+    if name == 'frontier_push':
+        items = [(node, node.depth + node.heuristic, node.heuristic) for node in samples]
+
+        def run(items):
+            frontier = BucketQueue()
+            for node, f, h in items:
+                frontier.push(node, f, h)
+            return frontier
+        return run, items
+
+    if name == 'frontier_pop':
+        frontier = BucketQueue()
+        for node in samples:
+            frontier.push(node, node.depth + node.heuristic, node.heuristic)
+        items = list(range(len(samples)))
+
+        def run(items, pop=frontier.pop):
+            for i in items:
+                pop()
+        return run, items
+
+    method = getattr(map_inst, name)
+    items = list(samples)
+
+    def run(items):
+        for node in items:
+            method(node)
+    return run, items
+
+
+def empty_loop(items):
+    for item in items:
+        pass
+
+
+def measure(map_inst, name, samples, repeat):
+    """
+    :return: (ns/op, retained blocks/op) for one operation over the samples
+    """
+    best = None
+    retained = None
+    gc.disable()
+    try:
+        for i in range(repeat):
+            run, items = operation(map_inst, name, samples)
+            start = time.perf_counter_ns()
+            empty_loop(items)
+            overhead = time.perf_counter_ns() - start
+            blocks = sys.getallocatedblocks()
+            start = time.perf_counter_ns()
+            kept = run(items)
+            elapsed = time.perf_counter_ns() - start - overhead
+            blocks = sys.getallocatedblocks() - blocks
+            if best is None or elapsed < best:
+                best = elapsed
+            if retained is None or blocks < retained:
+                retained = blocks
+            ops = len(items)
+            del run, items, kept
+    finally:
+        gc.enable()
+    return max(best, 0) / ops, retained / ops
+
+
+def microbench(level, operations, count, repeat, heuristic='manhattan', out=sys.stdout):
+    """
+    Time each operation on states sampled from a trace of one level and print a table
+    :return: {operation: (ns/op, retained blocks/op)}
+    """
+    map_inst = SokobanMap(level, heuristic)
+    samples = sample_states(map_inst, count)
+    out.write('%s: %d sampled states\n' % (level, len(samples)))
+    results = {}
+    for name in operations:
+        ns, retained = measure(map_inst, name, samples, repeat)
+        results[name] = (ns, retained)
+        out.write('  %-20s %10.1f ns/op %8.2f retained blocks/op\n' % (name, ns, retained))
+    out.flush()
+    return results
+
+
+def main(arglist):
+    """
+    Microbenchmark the solver's hot-path primitives on the given levels
+    :param arglist: command line arguments, see --help
+    """
+    parser = argparse.ArgumentParser(description='Time the Sokoban solver primitives on sampled search states.')
+    parser.add_argument('levels', nargs='*', default=['testcases'],
+                        help='level files, directories or glob patterns (default: testcases)')
+    parser.add_argument('-o', '--operations', default=','.join(OPERATIONS),
+                        help='comma separated, from: ' + ', '.join(OPERATIONS))
+    parser.add_argument('-n', '--samples', type=int, default=2000, help='states sampled per level')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='passes per operation, the fastest is kept')
+    parser.add_argument('--heuristic', choices=['manhattan', 'greedy', 'matching', 'pdb'], default='manhattan')
+    args = parser.parse_args(arglist)
+
+    operations = args.operations.split(',')
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error('unknown operation ' + name)
+    for level in find_levels(args.levels):
+        microbench(level, operations, args.samples, args.repeat, args.heuristic)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,356 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+from math import comb
+from itertools import combinations
+from collections import deque
+
+# Pattern databases for Sokoban box subsets.
+#
+# For every set of k boxes (k = 1 .. size) on a map, the database holds the exact number of
+# pushes needed to bring those boxes alone onto any k targets, from the best player
+# position. The other boxes are left out, so the value never overestimates the pushes the
+# same boxes need in the full state, and it does not depend on where the boxes start or
+# where the player is: the database belongs to the walls and targets only, and is shared by
+# every level with the same layout.
+#
+# Values are found by a retrograde (pull) breadth-first search from the solved subsets and
+# stored in a binary file named after a hash of the layout, which is memory-mapped when the
+# same map is solved again. Subsets are ranked over the live cells only (cells that are
+# not dead squares), since no box that can still be solved ever stands on a dead one, and
+# subset sizes whose table would pass MAX_TABLE_BYTES are left out:
+#
+#    python pattern_db.py testcases/new/4box_m3.txt --size 3
+
+
+MAGIC = b'SOKOPDB2'
+HEADER = struct.Struct('<8s20sHH')  # magic, layout digest, live cell count, largest subset size
+UNSOLVABLE = 255  # stored for subsets that can never all reach targets
+DEFAULT_SIZE = 3
+DEFAULT_DIR = 'pdb_cache'
+MAX_TABLE_BYTES = 1 << 28  # largest table built for one subset size
+PAIRING_BOXES = 8  # most boxes whose split into pairs is searched exactly
+
+
+def layout_digest(map_inst):
+    """
+    SHA-1 of the walls and targets of a map (boxes and player do not affect the database)
+    """
+    h = hashlib.sha1()
+    h.update(struct.pack('<HH', map_inst.x_size, map_inst.y_size))
+    h.update(map_inst.board.walls)
+    for target in sorted(map_inst.tgt_positions):
+        h.update(struct.pack('<HH', *target))
+    return h.digest()
+
+
+def live_cells(map_inst):
+    """
+    :return: list mapping each cell id to its index among the live (not dead) cells, -1 for
+             dead squares
+    """
+    live = []
+    count = 0
+    for c in range(len(map_inst.cells)):
+        if map_inst.dead[c]:
+            live.append(-1)
+        else:
+            live.append(count)
+            count += 1
+    return live
+
+
+def subset_size(map_inst, size):
+    """
+    Largest subset size, up to `size`, that the database for this map holds: no more than
+    the number of boxes, and no size whose table would pass MAX_TABLE_BYTES
+    """
+    cells = len(map_inst.cells) - sum(map_inst.dead)
+    size = min(size, map_inst.count)
+    while size > 1 and comb(cells, size) > MAX_TABLE_BYTES:
+        size -= 1
+    return size
+
+
+def rank(cells, k):
+    """
+    Index of a sorted k-subset of live cell indices in the combinatorial number system:
+    sum of comb(c_i, i) for the i-th smallest cell c_i, i = 1 .. k
+    """
+    return sum(comb(c, i + 1) for i, c in enumerate(cells[:k]))
+
+
+def retrograde(map_inst, k):
+    """
+    Pull search from every placement of k boxes on targets, with the other boxes removed.
+    States are a box bitmask plus the player's region (lowest reachable cell); each pull
+    costs one push, walking is free, so a plain breadth-first search gives exact costs.
+    Pulling a box only ever reaches cells it could be pushed back to a target from, which
+    are live, so every state found has a rank.
+    :return: bytearray of push counts indexed by rank, UNSOLVABLE where no placement was reached
+    """
+    n = len(map_inst.cells)
+    neighbours = map_inst.neighbours
+    bits = map_inst.player_bits
+    live = live_cells(map_inst)
+    targets = [map_inst.cell_id[t] for t in map_inst.tgt_positions]
+    values = bytearray([UNSOLVABLE]) * comb(n - sum(map_inst.dead), k)
+    seen = set()
+    queue = deque()
+    for placed in combinations(sorted(targets), k):
+        values[rank([live[c] for c in placed], k)] = 0
+        boxes = 0
+        for c in placed:
+            boxes |= 1 << c
+        for c in range(n):
+            if (boxes >> c) & 1:
+                continue
+            region = min(map_inst.player_distances(boxes, c))
+            if (boxes << bits) | region not in seen:
+                seen.add((boxes << bits) | region)
+                queue.append((boxes, region, 0))
+
+    while queue:
+        boxes, player, pushes = queue.popleft()
+        cells = sorted(map_inst.cells_of(boxes))
+        r = rank([live[c] for c in cells], k)
+        if values[r] > pushes:
+            values[r] = min(pushes, UNSOLVABLE - 1)
+        reachable = map_inst.player_distances(boxes, player)
+        for box in cells:
+            for d in range(4):
+                # the player stands on `stand` and steps back to `back`, pulling the box onto `stand`
+                stand = neighbours[box][d]
+                if stand in reachable:
+                    back = neighbours[stand][d]
+                    if back >= 0 and not (boxes >> back) & 1:
+                        new_boxes = boxes ^ (1 << box) | (1 << stand)
+                        region = min(map_inst.player_distances(new_boxes, back))
+                        key = (new_boxes << bits) | region
+                        if key not in seen:
+                            seen.add(key)
+                            queue.append((new_boxes, region, pushes + 1))
+    return values
+
+
+def build(map_inst, size=DEFAULT_SIZE):
+    """
+    :return: the database file contents for subsets of 1 .. size boxes (see subset_size)
+    """
+    size = subset_size(map_inst, size)
+    parts = [HEADER.pack(MAGIC, layout_digest(map_inst), len(map_inst.cells) - sum(map_inst.dead), size)]
+    for k in range(1, size + 1):
+        parts.append(bytes(retrograde(map_inst, k)))
+    return b''.join(parts)
+
+
+class PatternDatabase:
+    """
+    Read-only view of a pattern database file, memory-mapped
+    """
+
+    def __init__(self, path, map_inst):
+        """
+        :param map_inst: a map with the layout the file was built for
+        """
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, digest, cells, size = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.data.close()
+            raise ValueError('%s is not a pattern database' % path)
+        self.live = live_cells(map_inst)
+        if digest != layout_digest(map_inst) or cells != len(self.live) - self.live.count(-1):
+            self.data.close()
+            raise ValueError('%s was built for a different map' % path)
+        self.path = path
+        self.size = size
+        # offset of each subset size's table; offsets[k] + rank of a k-subset gives its byte
+        self.offsets = [0] * (size + 1)
+        offset = HEADER.size
+        for k in range(1, size + 1):
+            self.offsets[k] = offset
+            offset += comb(cells, k)
+        # comb(c, i) for every cell and i = 1 .. size, so lookups need no multiplications
+        self.binom = [[comb(c, i) for i in range(max(size, 3) + 1)] for c in range(cells)]
+
+    @classmethod
+    def load_or_build(cls, map_inst, directory=DEFAULT_DIR, size=DEFAULT_SIZE, log=None):
+        """
+        Map the database for this map's layout from `directory`, building and saving it first
+        if there is none (or only a smaller one). Several processes may build the same one at
+        once: each writes its own temporary file, and one that finds a database already saved
+        by another when it is done uses that one instead.
+        :param log: stream for a note when the database is built, or None
+        """
+        path = os.path.join(directory, '%s.pdb' % layout_digest(map_inst).hex())
+        size = subset_size(map_inst, size)
+        db = cls.open_saved(path, map_inst, size)
+        if db is not None:
+            return db
+        start = time.time()
+        data = build(map_inst, size)
+        db = cls.open_saved(path, map_inst, size)
+        if db is not None:
+            return db
+        os.makedirs(directory, exist_ok=True)
+        partial = '%s.%d.tmp' % (path, os.getpid())
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)  # never leave a half-written database under the real name
+        if log is not None:
+            log.write('built pattern database %s (%d bytes) in %.2fs\n' % (path, len(data), time.time() - start))
+        return cls(path, map_inst)
+
+    @classmethod
+    def open_saved(cls, path, map_inst, size):
+        """
+        :return: the database saved at path if it covers subsets of at least `size` boxes,
+                 otherwise None (also for a missing file or an older format)
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            db = cls(path, map_inst)
+        except ValueError:
+            return None  # an older format, rebuilt by load_or_build
+        if db.size >= size:
+            return db
+        db.close()
+        return None
+
+    def close(self):
+        self.data.close()
+
+    def lower_bound(self, boxes):
+        """
+        Admissible push count for the given box cells, the larger of two combinations:
+        additive - the best split of the boxes into disjoint pairs (plus one single box if
+                   the count is odd), summing each group's value; pushes move one box at a
+                   time, so disjoint groups never count the same push twice
+        max      - the largest value of any single group of k boxes, for the largest subset
+                   size k the database holds (at least 3) and no more than the box count;
+                   a group never needs fewer pushes than a smaller group inside it
+        :return: the bound, or None if some box or group can never reach targets
+        """
+        live = self.live
+        boxes = sorted(live[b] for b in boxes)
+        if boxes and boxes[0] < 0:
+            return None  # a box on a dead square
+        data = self.data
+        binom = self.binom
+        n = len(boxes)
+        single = [data[self.offsets[1] + b] for b in boxes]
+        if UNSOLVABLE in single:
+            return None
+        if self.size < 2 or n < 2:
+            return sum(single)
+        offset = self.offsets[2]
+        pair = [[0] * n for i in range(n)]
+        for i in range(n):
+            for j in range(i + 1, n):
+                value = data[offset + binom[boxes[i]][1] + binom[boxes[j]][2]]
+                if value == UNSOLVABLE:
+                    return None
+                pair[i][j] = value
+        if n <= PAIRING_BOXES:
+            bound = self.best_pairing(pair, single, (1 << n) - 1, {})
+        else:
+            bound = self.greedy_pairing(pair, single)
+        size = min(self.size, n)
+        if size == 3:
+            offset = self.offsets[3]
+            for i, j, k in combinations(range(n), 3):
+                value = data[offset + binom[boxes[i]][1] + binom[boxes[j]][2] + binom[boxes[k]][3]]
+                if value == UNSOLVABLE:
+                    return None
+                if value > bound:
+                    bound = value
+        elif size > 3:
+            offset = self.offsets[size]
+            columns = range(1, size + 1)
+            for group in combinations(boxes, size):
+                index = offset
+                for i, b in zip(columns, group):
+                    index += binom[b][i]
+                value = data[index]
+                if value == UNSOLVABLE:
+                    return None
+                if value > bound:
+                    bound = value
+        return bound
+
+    def best_pairing(self, pair, single, rest, memo):
+        """
+        Largest sum over splits of the boxes in `rest` (a bitmask of indices) into pairs, one
+        box left single when the count is odd. A pair is never worth less than its two boxes
+        alone, so splits with more single boxes than that need not be tried. Results are
+        memoised per remaining set in `memo`.
+        """
+        if not rest:
+            return 0
+        if rest in memo:
+            return memo[rest]
+        low = rest & -rest
+        first = low.bit_length() - 1
+        others = rest ^ low
+        best = 0
+        if bin(rest).count('1') % 2:
+            best = single[first] + self.best_pairing(pair, single, others, memo)
+        row = pair[first]
+        bits = others
+        while bits:
+            low = bits & -bits
+            value = row[low.bit_length() - 1] + self.best_pairing(pair, single, others ^ low, memo)
+            if value > best:
+                best = value
+            bits ^= low
+        memo[rest] = best
+        return best
+
+    def greedy_pairing(self, pair, single):
+        """
+        Sum over one split of the boxes into pairs and single boxes, taking pairs in order of
+        what they add over their boxes alone: used past PAIRING_BOXES boxes, where the exact
+        search is too slow. Any split into disjoint groups is admissible, so this is too,
+        if weaker than best_pairing.
+        """
+        n = len(single)
+        gains = sorted(((pair[i][j] - single[i] - single[j], i, j)
+                        for i in range(n) for j in range(i + 1, n)), reverse=True)
+        total = sum(single)
+        paired = set()
+        for gain, i, j in gains:
+            if gain <= 0:
+                break
+            if i not in paired and j not in paired:
+                paired.update((i, j))
+                total += gain
+        return total
+
+
+def main(arglist):
+    """
+    Build (or find) the pattern database for each given map file
+    :param arglist: command line arguments, see --help
+    """
+    from solver import SokobanMap
+
+    parser = argparse.ArgumentParser(description='Build Sokoban pattern databases for box subsets.')
+    parser.add_argument('map_files', nargs='+')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='largest box subset (default %(default)s)')
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='database directory (default %(default)s)')
+    args = parser.parse_args(arglist)
+
+    for filename in args.map_files:
+        db = PatternDatabase.load_or_build(SokobanMap(filename), args.dir, args.size, sys.stdout)
+        print(filename, '->', db.path)
+        db.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
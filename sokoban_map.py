@@ -1,5 +1,7 @@
 import sys
 
+from board import Board, DIRECTION
+
 
 class SokobanMap:
     """
@@ -39,54 +41,29 @@ class SokobanMap:
         Build a Sokoban map instance from the given file name
         :param filename:
         """
-        f = open(filename, 'r')
-
-        rows = []
-        for line in f:
-            if len(line.strip()) > 0:
-                rows.append(list(line.strip()))
-
-        f.close()
-
-        row_len = len(rows[0])
-        for row in rows:
-            assert len(row) == row_len, "Mismatch in row length"
-
-        num_rows = len(rows)
-
-        box_positions = []
-        tgt_positions = []
-        player_position = None
-        for i in range(num_rows):
-            for j in range(row_len):
-                if rows[i][j] == self.BOX_SYMBOL:
-                    box_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.TGT_SYMBOL:
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_SYMBOL:
-                    player_position = (i, j)
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.BOX_ON_TGT_SYMBOL:
-                    box_positions.append((i, j))
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_ON_TGT_SYMBOL:
-                    player_position = (i, j)
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-
-        assert len(box_positions) == len(tgt_positions), "Number of boxes does not match number of targets"
-
-        self.x_size = row_len
-        self.y_size = num_rows
-        self.box_positions = box_positions
-        self.tgt_positions = tgt_positions
-        self.player_position = player_position
-        self.player_x = player_position[1]
-        self.player_y = player_position[0]
-        self.obstacle_map = rows
+        self.board = Board.load(filename)
+        self.x_size = self.board.x_size
+        self.y_size = self.board.y_size
+        self.tgt_positions = self.board.positions(self.board.targets)
+        # the moving parts: box bitboard and player cell index on the board
+        self.boxes = self.board.boxes
+        self.player = self.board.player
+
+    @property
+    def box_positions(self):
+        return self.board.positions(self.boxes)
+
+    @property
+    def player_position(self):
+        return self.board.position(self.player)
+
+    @property
+    def player_x(self):
+        return self.player_position[1]
+
+    @property
+    def player_y(self):
+        return self.player_position[0]
 
     def apply_move(self, move):
         """
@@ -94,103 +71,20 @@ class SokobanMap:
         :param move: 'L', 'R', 'U' or 'D'
         :return: True if move was successful, false if move could not be completed
         """
-        # basic obstacle check
-        if move == self.LEFT:
-            if self.obstacle_map[self.player_y][self.player_x - 1] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x - 1
-                new_y = self.player_y
-
-        elif move == self.RIGHT:
-            if self.obstacle_map[self.player_y][self.player_x + 1] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x + 1
-                new_y = self.player_y
-
-        elif move == self.UP:
-            if self.obstacle_map[self.player_y - 1][self.player_x] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x
-                new_y = self.player_y - 1
-
-        else:
-            if self.obstacle_map[self.player_y + 1][self.player_x] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = self.player_x
-                new_y = self.player_y + 1
-
-        # pushed box collision check
-        if (new_y, new_x) in self.box_positions:
-            if move == self.LEFT:
-                if self.obstacle_map[new_y][new_x - 1] == self.OBSTACLE_SYMBOL or (new_y, new_x - 1) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x - 1
-                    new_box_y = new_y
-
-            elif move == self.RIGHT:
-                if self.obstacle_map[new_y][new_x + 1] == self.OBSTACLE_SYMBOL or (new_y, new_x + 1) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x + 1
-                    new_box_y = new_y
-
-            elif move == self.UP:
-                if self.obstacle_map[new_y - 1][new_x] == self.OBSTACLE_SYMBOL  or (new_y - 1, new_x) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x
-                    new_box_y = new_y - 1
-
-            else:
-                if self.obstacle_map[new_y + 1][new_x] == self.OBSTACLE_SYMBOL or (new_y + 1, new_x) in self.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x
-                    new_box_y = new_y + 1
-
-            # update box position
-            self.box_positions.remove((new_y, new_x))
-            self.box_positions.append((new_box_y, new_box_x))
-
-        # update player position
-        self.player_x = new_x
-        self.player_y = new_y
-
+        state = self.board.move(self.boxes, self.player, DIRECTION[move])
+        if state is None:
+            return False
+        self.boxes, self.player = state
         return True
 
     def render(self):
         """
         Render the map's current state to terminal
         """
-        for r in range(self.y_size):
-            line = ''
-            for c in range(self.x_size):
-                symbol = self.FREE_GLYPH
-                if self.obstacle_map[r][c] == self.OBSTACLE_SYMBOL:
-                    symbol = self.OBST_GLYPH
-                if (r, c) in self.tgt_positions:
-                    symbol = self.TGT_GLYPH
-                # box or player overwrites tgt
-                if (r, c) in self.box_positions:
-                    symbol = self.BOX_GLYPH
-                if self.player_x == c and self.player_y == r:
-                    symbol = self.PLAYER_GLYPH
-                line += symbol
-            print(line)
-
-        print('\n\n')
+        self.board.render(self.boxes, self.player)
 
     def is_finished(self):
-        finished = True
-        for i in self.box_positions:
-            if i not in self.tgt_positions:
-                finished = False
-        return finished
+        return self.board.is_finished(self.boxes)
 
 
 def main(arglist):
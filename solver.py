@@ -1,7 +1,29 @@
+import os
 import sys
+import json
 import time
-import copy
+import argparse
 import heapq
+import random
+import itertools
+from array import array
+from collections import deque
+
+import board
+import pattern_db
+import level_cache
+import external_search
+import batch_search
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # distance tables are built with plain breadth-first searches instead
 
 # Some code sourced from:
 # AI Sem2 2019 Tutorial 2 Soltuions
@@ -42,6 +64,10 @@ class SokobanMap:
     UP = 'u'
     DOWN = 'd'
 
+    # (move, dy, dx) in expansion order, as on the board; the opposite of direction d is d ^ 1
+    MOVES = board.MOVES
+    DIRECTION = board.DIRECTION
+
     # render characters
     FREE_GLYPH = '   '
     OBST_GLYPH = 'XXX'
@@ -49,69 +75,146 @@ class SokobanMap:
     TGT_GLYPH = '(T)'
     PLAYER_GLYPH = '<P>'
 
-    def __init__(self, filename):
+    # push distance used for a box that can never reach a target
+    UNREACHABLE = 10 ** 6
+
+    # anytime A* weights are kept in tenths, so weighted priorities stay integers
+    WEIGHT_SCALE = 10
+
+    # cell_dist entry for cells in separate parts of the map
+    NO_PATH = 0xFFFF
+    # largest number of floor cells cell_dist is built for: it takes 2 * cells^2 bytes (2 MB
+    # here) and about 0.2s to build at this size with NumPy, 0.5s without; the bundled levels
+    # have under 60 cells
+    CELL_DIST_CELLS = 1024
+
+    # fraction of the memory limit a search is cut back to once it goes over
+    LOW_WATER = 0.75
+    # lowest factor calibrate scales a memory estimate by, in case the allocator had room
+    # left over from before the search and its resident size barely grew
+    MIN_RSS_SCALE = 0.25
+    # rough cost of one dict entry keyed by a packed state int (slot, hash table share, key)
+    DICT_ENTRY_BYTES = 100
+
+    def __init__(self, filename, heuristic='manhattan', cache=None):
         """
         Build a Sokoban map instance from the given file name
         :param filename:
+        :param heuristic: 'manhattan', 'greedy', 'matching' or 'pdb' (see set_heuristic)
+        :param cache: optional level_cache.LevelCache to load the distance tables from
         """
-        f = open(filename, 'r')
-
-        rows = []
-        for line in f:
-            if len(line.strip()) > 0:
-                rows.append(list(line.strip()))
-
-        f.close()
-
-        row_len = len(rows[0])
-        for row in rows:
-            assert len(row) == row_len, "Mismatch in row length"
+        self.board = board.Board.load(filename)
+        layout = self.board
+        self.x_size = layout.x_size
+        self.y_size = layout.y_size
+        self.box_positions = layout.positions(layout.boxes)
+        self.tgt_positions = layout.positions(layout.targets)
+        self.player_position = layout.position(layout.player)
+        self.player_x = self.player_position[1]
+        self.player_y = self.player_position[0]
+        self.count = len(self.tgt_positions)
 
-        num_rows = len(rows)
+        # every floor cell of the board gets a compact index, used to pack states into a single
+        # int: the searches' box bitmasks have one bit per floor cell rather than per board cell
+        self.cells = []
+        self.cell_id = {}
+        self.board_cell = layout.floor()
+        self.compact = [-1] * layout.size
+        for c, i in enumerate(self.board_cell):
+            self.compact[i] = c
+            self.cells.append(layout.position(i))
+            self.cell_id[self.cells[c]] = c
+        self.player_bits = len(self.cells).bit_length()
+        # neighbouring cell index for each direction in MOVES (the board's offsets, resolved
+        # once), -1 where the neighbour is an obstacle
+        self.neighbours = [tuple(self.compact[i + step] for step in layout.offsets) for i in self.board_cell]
+        # seconds spent building each distance table at load time (absent when it was cached)
+        self.table_time = {}
+        # Manhattan distance from each cell to its nearest target
+        if not self.tgt_positions:
+            self.tgt_manhattan = [0] * len(self.cells)  # a level without boxes is already solved
+        elif np is not None:
+            cells = np.array(self.cells).reshape(-1, 2)
+            targets = np.array(self.tgt_positions).reshape(-1, 2)
+            self.tgt_manhattan = np.abs(cells[:, None, :] - targets[None, :, :]).sum(axis=2).min(axis=1).tolist()
+        else:
+            self.tgt_manhattan = []
+            for (i, j) in self.cells:
+                self.tgt_manhattan.append(min(abs(i - t[0]) + abs(j - t[1]) for t in self.tgt_positions))
+        # pushes needed to bring a lone box from each cell to each target, dead squares (cells
+        # from which a box can never be pushed onto any target) and the walking distance between
+        # every pair of cells on the map without boxes, or None when there are too many cells
+        tables = cache.get_tables(self) if cache is not None else None
+        if tables is None:
+            start = time.perf_counter()
+            push_dist, dead = self.distance_tables()
+            self.table_time['push distances'] = time.perf_counter() - start
+            cell_dist = None
+            if len(self.cells) <= self.CELL_DIST_CELLS:
+                start = time.perf_counter()
+                cell_dist = self.cell_distances()
+                self.table_time['cell distances'] = time.perf_counter() - start
+            tables = (push_dist, dead, cell_dist)
+            if cache is not None:
+                cache.put_tables(self, tables)
+        self.push_dist, self.dead, self.cell_dist = tables
+        # the same as an int32 array, for the NumPy code; the heuristics index the lists, which
+        # is faster than indexing an array one element at a time
+        self.push_table = np.array(self.push_dist, dtype=np.int32) if np is not None else None
+        # pattern database for the 'pdb' heuristic, mapped (or built) on first use
+        self.pattern_db = None
+        self.pdb_dir = pattern_db.DEFAULT_DIR
+        self.pdb_size = pattern_db.DEFAULT_SIZE
+        self.set_heuristic(heuristic)
+        # debug cross-check: compare every incremental heuristic update with a full recomputation
+        self.check_heuristic = False
+        self.tgt_bits = self.box_key(self.tgt_positions)
+        # Zobrist keys: one random 64-bit word per (cell, box) and per (cell, player); a state's
+        # hash is the XOR of its words, so a move updates it in O(1). Seeded for repeatable runs.
+        rng = random.Random(3702)
+        self.zobrist_box = [rng.getrandbits(64) for c in self.cells]
+        self.zobrist_player = [rng.getrandbits(64) for c in self.cells]
+        # time the move generation / heuristic / hashing phases of each search (adds overhead)
+        self.profile = False
+        # estimated bytes a search may use (see over_budget), 0 for no limit, and the number
+        # of the current search's nodes over_budget last found to have been freed
+        self.memory_limit = 0
+        self.freed_nodes = 0
+        # resident bytes when the current search began and at its highest check so far, and
+        # the measured growth over the structure estimate at that point (see calibrate)
+        self.rss_base = None
+        self.rss_peak = None
+        self.rss_scale = 1.0
+        # stream for JSON-lines progress reports during a search, and seconds between reports
+        self.progress = None
+        self.progress_interval = 1.0
+        # entries in the transposition table used by the searches
+        self.tt_size = TranspositionTable.DEFAULT_SIZE
+        # explored set of astar, ucs and push: 'table' (the transposition table) or
+        # 'fingerprint' (a ClosedSet), and the size of the ClosedSet's Bloom filter in bits
+        self.explored_backend = 'table'
+        self.bloom_bits = 0
+        # IDA* keeps a much smaller table, 0 turns it off
+        self.ida_tt_size = 1 << 16
+        # anytime A*: starting heuristic weight, how much it drops per pass, and the time
+        # budget in seconds (None: run until the solution is proven optimal)
+        self.ara_weight = 3.0
+        self.ara_step = 0.5
+        self.deadline = None
+        # external BFS: directory for its run files (None: system temp) and the number of
+        # child states buffered in memory before a run is spilled
+        self.spill_dir = None
+        self.spill_states = external_search.DEFAULT_SPILL_STATES
+        # batch searches: states expanded together with NumPy
+        self.batch_size = batch_search.BLOCK_STATES
+        # number of pushes refused for landing on a dead square / freezing a box off target
+        self.pruned_dead = 0
+        self.pruned_frozen = 0
 
-        
-        box_positions = []
-        tgt_positions = []
-        player_position = None
-        
-        
-        for i in range(num_rows):
-            for j in range(row_len):
-                if rows[i][j] == self.BOX_SYMBOL:
-                    box_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.TGT_SYMBOL:
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_SYMBOL:
-                    player_position = (i, j)
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.BOX_ON_TGT_SYMBOL:
-                    box_positions.append((i, j))
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-                elif rows[i][j] == self.PLAYER_ON_TGT_SYMBOL:
-                    player_position = (i, j)
-                    tgt_positions.append((i, j))
-                    rows[i][j] = self.FREE_SPACE_SYMBOL
-
-        assert len(box_positions) == len(tgt_positions), "Number of boxes does not match number of targets"
-
-        self.x_size = row_len
-        self.y_size = num_rows
-        self.box_positions = box_positions
-        self.tgt_positions = tgt_positions
-        self.player_position = player_position
-        self.player_x = player_position[1]
-        self.player_y = player_position[0]
-        self.obstacle_map = rows
-        self.count = len(self.tgt_positions)
-        
         self.rootNode = Node()
-        self.rootNode.setBox_positions(self.box_positions)
-        self.rootNode.setPlayer_position(self.player_position)
-        
-        self.set_state_wp(self.rootNode)
+        self.rootNode.boxes = self.box_key(self.box_positions)
+        self.rootNode.player = self.cell_id[self.player_position]
+        self.rootNode.zkey = self.zobrist(self.cells_of(self.rootNode.boxes), self.rootNode.player)
 
         
     def apply_move(self, move, node):
@@ -121,115 +224,573 @@ class SokobanMap:
         :return: True if move was successful, false if move could not be completed
         """
         
-        # basic obstacle check
-        if move == self.LEFT:
-            if self.obstacle_map[node.player_y][node.player_x - 1] == self.OBSTACLE_SYMBOL:
-                return False
-            else:
-                new_x = node.player_x - 1
-                new_y = node.player_y
+        d = self.DIRECTION[move]
+        new = self.neighbours[node.player][d]
+        if new < 0:
+            return False
 
-        elif move == self.RIGHT:
-            if self.obstacle_map[node.player_y][node.player_x + 1] == self.OBSTACLE_SYMBOL:
+        # pushed box collision check
+        if (node.boxes >> new) & 1:
+            new_box = self.neighbours[new][d]
+            if new_box < 0 or (node.boxes >> new_box) & 1:
                 return False
-            else:
-                new_x = node.player_x + 1
-                new_y = node.player_y
 
-        elif move == self.UP:
-            if self.obstacle_map[node.player_y - 1][node.player_x] == self.OBSTACLE_SYMBOL:
+            # never push a box onto a dead square
+            if self.dead[new_box]:
+                self.pruned_dead += 1
                 return False
-            else:
-                new_x = node.player_x
-                new_y = node.player_y - 1
 
-        else:
-            if self.obstacle_map[node.player_y + 1][node.player_x] == self.OBSTACLE_SYMBOL:
+            # or into a position where it freezes off target
+            boxes = node.boxes ^ (1 << new) | (1 << new_box)
+            if self.freeze_deadlock(boxes, new_box):
+                self.pruned_frozen += 1
                 return False
-            else:
-                new_x = node.player_x
-                new_y = node.player_y + 1
+            node.boxes = boxes
+            node.pushed = (new, new_box)
+            node.zkey ^= self.zobrist_box[new] ^ self.zobrist_box[new_box]
 
-        # pushed box collision check
-        if (new_y, new_x) in node.box_positions:
-            if move == self.LEFT:
-                if self.obstacle_map[new_y][new_x - 1] == self.OBSTACLE_SYMBOL or (new_y, new_x - 1) in node.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x - 1
-                    new_box_y = new_y
+        # update player position
+        node.zkey ^= self.zobrist_player[node.player] ^ self.zobrist_player[new]
+        node.player = new
 
-            elif move == self.RIGHT:
-                if self.obstacle_map[new_y][new_x + 1] == self.OBSTACLE_SYMBOL or (new_y, new_x + 1) in node.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x + 1
-                    new_box_y = new_y
+        return True
+    
+    def box_key(self, box_positions):
+        """
+        Pack a collection of box positions into an int with one bit per occupied cell.
+        The result does not depend on the order the boxes are listed in.
+        """
+        key = 0
+        for box in box_positions:
+            key |= 1 << self.cell_id[box]
+        return key
 
-            elif move == self.UP:
-                if self.obstacle_map[new_y - 1][new_x] == self.OBSTACLE_SYMBOL  or (new_y - 1, new_x) in node.box_positions:
-                    return False
+    def state_key(self, box_positions, player_position):
+        """
+        Canonical state key: the packed box cells followed by the player cell index
+        """
+        return (self.box_key(box_positions) << self.player_bits) | self.cell_id[player_position]
+
+    def zobrist(self, boxes, player):
+        """
+        Zobrist hash of the given box cells and player cell
+        """
+        key = self.zobrist_player[player]
+        for box in boxes:
+            key ^= self.zobrist_box[box]
+        return key
+
+    def goal_state(self):
+        return self.box_key(self.tgt_positions)
+
+    def neighbour_array(self):
+        """
+        neighbours as an (n, 4) NumPy array with obstacles as n rather than -1, so that it can
+        index an array with one extra, always-empty column
+        """
+        n = len(self.cells)
+        neighbours = np.array(self.neighbours, dtype=np.intp).reshape(n, 4)
+        neighbours[neighbours < 0] = n
+        return neighbours
+
+    def cell_distances(self):
+        """
+        Walking distances between all pairs of cells with no boxes on the map, NO_PATH between
+        cells that are not connected. With NumPy this is an (n, n) uint16 array, built by
+        running the breadth-first searches from every cell together: each step expands all
+        (source, cell) pairs of the last layer at once. Otherwise it is a list of array('H')
+        rows from one search per cell.
+        """
+        n = len(self.cells)
+        if np is None:
+            rows = []
+            for c in range(n):
+                row = array('H', [self.NO_PATH]) * n
+                for cell, steps in self.player_distances(0, c).items():
+                    row[cell] = steps
+                rows.append(row)
+            return rows
+        neighbours = np.array(self.neighbours, dtype=np.intp).reshape(n, 4)
+        dist = np.full((n, n), self.NO_PATH, dtype=np.uint16)
+        owner = np.empty((n, n), dtype=np.int32)  # which candidate pair claimed an entry first
+        source = np.arange(n)
+        cell = np.arange(n)
+        dist[source, cell] = 0
+        steps = 0
+        while len(source):
+            steps += 1
+            source = np.repeat(source, 4)
+            cell = neighbours[cell].ravel()
+            keep = cell >= 0
+            source, cell = source[keep], cell[keep]
+            keep = dist[source, cell] == self.NO_PATH
+            source, cell = source[keep], cell[keep]
+            # a pair reached from several cells of the layer is kept once
+            index = np.arange(len(source), dtype=np.int32)
+            owner[source, cell] = index
+            keep = owner[source, cell] == index
+            source, cell = source[keep], cell[keep]
+            dist[source, cell] = steps
+        return dist
+
+    def distance_tables(self):
+        """
+        :return: (push_dist, dead) - push_dist[t][c] is the number of pushes to bring a lone box
+                 from cell c to target t (UNREACHABLE if it never can be), and dead[c] is 1
+                 for cells no target can be reached from. With NumPy the pull searches from
+                 all targets run together, one step at a time over arrays.
+        """
+        if np is not None:
+            n = len(self.cells)
+            targets = [self.cell_id[t] for t in self.tgt_positions]
+            neighbours = self.neighbour_array()
+            dist = np.full((len(targets), n), self.UNREACHABLE, dtype=np.int64)
+            reached = np.zeros((len(targets), n + 1), dtype=bool)
+            dist[np.arange(len(targets)), targets] = 0
+            reached[np.arange(len(targets)), targets] = True
+            frontier = reached.copy()
+            pushes = 0
+            while frontier.any():
+                pushes += 1
+                new = np.zeros((len(targets), n), dtype=bool)
+                for d in range(4):
+                    # a box on p can be pushed onto its neighbour in direction d ^ 1 by a player
+                    # standing on its neighbour in direction d
+                    new |= frontier[:, neighbours[:, d ^ 1]] & (neighbours[:, d] < n)
+                new &= ~reached[:, :n]
+                dist[new] = pushes
+                reached[:, :n] |= new
+                frontier[:, :n] = new
+            return dist.tolist(), bytearray((dist >= self.UNREACHABLE).all(axis=0).astype(np.uint8))
+        push_dist = []
+        dead = bytearray(b'\x01') * len(self.cells)
+        for t in self.tgt_positions:
+            dists = self.pull_distances(self.cell_id[t])
+            for c, dist in enumerate(dists):
+                if dist is None:
+                    dists[c] = self.UNREACHABLE
                 else:
-                    new_box_x = new_x
-                    new_box_y = new_y - 1
+                    dead[c] = 0
+            push_dist.append(dists)
+        return push_dist, dead
+
+    def pull_distances(self, target):
+        """
+        Reverse search from a target, pulling a lone box away from it on the empty map.
+        :param target: target cell index
+        :return: list with the number of pushes needed to bring a box from each cell to
+                 the target, None for cells it can never be brought from
+        """
+        dist = [None] * len(self.cells)
+        dist[target] = 0
+        queue = deque([target])
+        while queue:
+            c = queue.popleft()
+            for d in range(4):
+                # the box came from p, pushed by a player standing on the far side of p
+                p = self.neighbours[c][d]
+                if p >= 0 and dist[p] is None and self.neighbours[p][d] >= 0:
+                    dist[p] = dist[c] + 1
+                    queue.append(p)
+        return dist
 
+    def frozen_boxes(self, boxes, box, walls):
+        """
+        Check whether the box on cell `box` can never move again, treating the cells in
+        `walls` (boxes already under examination) as walls.
+        :return: list of the boxes that are frozen together with this one, None if it can move
+        """
+        walls = walls | {box}
+        frozen = [box]
+        for d in (0, 2):  # vertical then horizontal axis
+            a = self.neighbours[box][d]
+            b = self.neighbours[box][d + 1]
+            # blocked by a wall, or only movable onto dead squares
+            if a < 0 or b < 0 or a in walls or b in walls or (self.dead[a] and self.dead[b]):
+                continue
+            # blocked by a neighbouring box that is itself frozen
+            for n in (a, b):
+                if (boxes >> n) & 1:
+                    blocked = self.frozen_boxes(boxes, n, walls)
+                    if blocked is not None:
+                        frozen.extend(blocked)
+                        break
             else:
-                if self.obstacle_map[new_y + 1][new_x] == self.OBSTACLE_SYMBOL or (new_y + 1, new_x) in node.box_positions:
-                    return False
-                else:
-                    new_box_x = new_x
-                    new_box_y = new_y + 1
+                return None
+        return frozen
 
-            # update box position
-            node.box_positions.remove((new_y, new_x))
-            node.box_positions.append((new_box_y, new_box_x))
+    def freeze_deadlock(self, boxes, box):
+        """
+        Freeze deadlock test for the box that was just pushed onto `box`: true when it is
+        wedged (against walls, dead squares or other frozen boxes, which covers 2x2 blocks)
+        so that it and its frozen neighbours can never move, and one of them is off target.
+        Only the boxes around the pushed one are examined.
+        """
+        frozen = self.frozen_boxes(boxes, box, frozenset())
+        if frozen is not None:
+            for b in frozen:
+                if not (self.tgt_bits >> b) & 1:
+                    return True
+        return False
 
-        # update player position
-        node.setPlayer_position((new_y, new_x))
+    def cells_of(self, bits):
+        """
+        Yield the cell indices set in a packed bitmask (see box_key)
+        """
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def player_distances(self, boxes, player):
+        """
+        Flood fill the cells the player can walk to without pushing a box.
+        :param boxes: packed box cells
+        :param player: player cell index
+        :return: dict of reachable cell -> number of steps from the player
+        """
+        dist = {player: 0}
+        queue = deque([player])
+        while queue:
+            c = queue.popleft()
+            for n in self.neighbours[c]:
+                if n >= 0 and n not in dist and not (boxes >> n) & 1:
+                    dist[n] = dist[c] + 1
+                    queue.append(n)
+        return dist
 
+    def walk(self, boxes, start, end):
+        """
+        Shortest list of player moves from start to end that does not push any box: A* with
+        the walking distance on the map without boxes (cell_dist) as its estimate, or a
+        breadth-first search on maps too large for that table
+        """
+        came_from = {start: None}
+        if self.cell_dist is None:
+            queue = deque([start])
+            while queue:
+                c = queue.popleft()
+                if c == end:
+                    break
+                for d, n in enumerate(self.neighbours[c]):
+                    if n >= 0 and n not in came_from and not (boxes >> n) & 1:
+                        came_from[n] = (c, d)
+                        queue.append(n)
+        else:
+            estimate = self.cell_dist
+            cost = {start: 0}
+            queue = [(int(estimate[start][end]), 0, start)]
+            while queue:
+                f, g, c = heapq.heappop(queue)
+                if c == end:
+                    break
+                if g > cost[c]:
+                    continue
+                for d, n in enumerate(self.neighbours[c]):
+                    if n >= 0 and not (boxes >> n) & 1 and g + 1 < cost.get(n, self.UNREACHABLE):
+                        came_from[n] = (c, d)
+                        cost[n] = g + 1
+                        heapq.heappush(queue, (g + 1 + int(estimate[n][end]), g + 1, n))
+        moves = []
+        while came_from[end] is not None:
+            end, d = came_from[end]
+            moves.append(self.MOVES[d][0])
+        moves.reverse()
+        return moves
 
-        return True
-    
-    def set_state_wp(self, node):
-        state = self.tgt_positions.copy()
-        for i in node.box_positions:
-            state.append(i)
-        state.append((node.player_x, node.player_y))       
-        node.setState(tuple(state))
-        return
+    def push_state(self, node):
+        """
+        Key of a push-level node for the bidirectional search: its boxes plus the lowest cell
+        of the player's reachable region, so every player position inside one region maps to
+        the same state and a pull can meet a push wherever the player stands
+        """
+        region = min(self.player_distances(node.boxes, node.player))
+        return (node.boxes << self.player_bits) | region
 
-        
-    def goal_state(self):
-        states = self.tgt_positions.copy()
-        for i in self.tgt_positions:
-            states.append(i)     
-        return tuple(states)
-    
-    def calc_heuristic2(self, node):
-        mnhtn_dist = 0
-        for box in node.box_positions:
-            if box not in self.tgt_positions:
-                x = abs(box[0] - node.player_position[0]) + abs(box[1] - node.player_position[1])
-                if(x < mnhtn_dist):
-                    mnhtn_dist = x
-                
-        node.setHeuristic(mnhtn_dist)
-        return
+    def push_children(self, node):
+        """
+        Generate one child per box push the player can walk to from its current cell.
+        The child's depth is the parent's plus the walk length plus the push itself, and its
+        Zobrist hash is updated from the parent's for the moved box and the player's new cell.
+        """
+        dist = self.player_distances(node.boxes, node.player)
+        boxes = node.boxes
+        children = []
+        for box in self.cells_of(boxes):
+            for d in range(4):
+                behind = self.neighbours[box][d ^ 1]
+                ahead = self.neighbours[box][d]
+                if behind in dist and ahead >= 0 and not (boxes >> ahead) & 1:
+                    if self.dead[ahead]:
+                        self.pruned_dead += 1
+                        continue
+                    new_boxes = boxes ^ (1 << box) | (1 << ahead)
+                    if self.freeze_deadlock(new_boxes, ahead):
+                        self.pruned_frozen += 1
+                        continue
+                    child = Node(node, (box, d), node.depth + dist[behind] + 1)
+                    child.boxes = new_boxes
+                    child.player = box
+                    child.pushed = (box, ahead)
+                    child.zkey = (node.zkey ^ self.zobrist_player[node.player] ^ self.zobrist_player[box]
+                                  ^ self.zobrist_box[box] ^ self.zobrist_box[ahead])
+                    children.append(child)
+        return children
+
+    def pull_children(self, node):
+        """
+        Generate the predecessors of a push-level node for the backward search: one child per
+        box the player can walk up to and pull one cell towards itself. Each child's action is
+        the push that undoes that pull, so walking from a backward node towards its root reads
+        the pushes in forward order.
+        """
+        dist = self.player_distances(node.boxes, node.player)
+        boxes = node.boxes
+        children = []
+        for box in self.cells_of(boxes):
+            for d in range(4):
+                stand = self.neighbours[box][d]
+                if stand in dist:
+                    back = self.neighbours[stand][d]
+                    if back >= 0 and not (boxes >> back) & 1:
+                        child = Node(node, (stand, d ^ 1), node.depth + 1)
+                        child.boxes = boxes ^ (1 << box) | (1 << stand)
+                        child.player = back
+                        child.pushed = (box, stand)
+                        children.append(child)
+        return children
+
+    def pull_roots(self):
+        """
+        Start nodes of the backward search: every box on a target, with the player in each
+        region next to a box (a final push always leaves the player beside the box it moved)
+        """
+        boxes = self.tgt_bits
+        roots = []
+        seen = set()
+        for c in range(len(self.cells)):
+            if (boxes >> c) & 1 or c in seen:
+                continue
+            region = self.player_distances(boxes, c)
+            seen.update(region)
+            if any(n >= 0 and (boxes >> n) & 1 for r in region for n in self.neighbours[r]):
+                root = Node()
+                root.boxes = boxes
+                root.player = c
+                roots.append(root)
+        return roots
+
+    def expand_pushes(self, boxes, player, pushes):
+        """
+        Rebuild the full move list for a sequence of (box cell, direction) pushes,
+        walking the player along a shortest path to each push.
+        """
+        solution = []
+        for box, d in pushes:
+            solution.extend(self.walk(boxes, player, self.neighbours[box][d ^ 1]))
+            solution.append(self.MOVES[d][0])
+            boxes = boxes ^ (1 << box) | (1 << self.neighbours[box][d])
+            player = box
+        return solution
     
+    def set_heuristic(self, name):
+        """
+        Select the box heuristic used by calc_heuristicAstar and calc_heuristicPush.
+        :param name: 'manhattan' - each box's Manhattan distance to its nearest target
+                     'greedy'    - boxes greedily assigned to distinct targets by push distance
+                                   (cheap, but can overestimate so A* may lose optimality)
+                     'matching'  - minimum-cost box to target assignment by push distance
+                     'pdb'       - the larger of 'matching' and the pattern database bound for
+                                   subsets of up to pdb_size boxes (see pattern_db.py)
+
+        Each heuristic is a pair of functions. The full one takes a list of box cells and
+        returns (h, cache); the delta one takes a parent's (h, cache) and the cell a single
+        box moved from and to, and returns the child's (h, cache) without starting over.
+        """
+        heuristics = {'manhattan': (self.nearest_target_cost, self.nearest_target_delta),
+                      'greedy': (self.greedy_matching_cost, self.greedy_matching_delta),
+                      'matching': (self.matching_cost, self.matching_delta),
+                      'pdb': (self.pattern_cost, self.pattern_delta)}
+        self.heuristic_name = name
+        self.box_heuristic, self.box_heuristic_delta = heuristics[name]
+
+    def nearest_target_cost(self, boxes):
+        # per-box contributions only depend on the box's cell, so nothing needs caching
+        return sum(self.tgt_manhattan[b] for b in boxes), None
+
+    def nearest_target_delta(self, h, cache, old, new):
+        return h - self.tgt_manhattan[old] + self.tgt_manhattan[new], None
+
+    def greedy_matching_cost(self, boxes):
+        """
+        Assign box/target pairs in order of increasing push distance, skipping boxes and
+        targets that are already taken, and pairs the box can never reach. When that leaves
+        a box unassigned the greedy order was wrong, not necessarily the state, so the
+        minimum-cost matching decides whether every box can get a reachable target.
+        """
+        pairs = sorted((dists[b], b, t) for t, dists in enumerate(self.push_dist) for b in boxes)
+        used_boxes = set()
+        used_targets = set()
+        total = 0
+        for dist, b, t in pairs:
+            if dist >= self.UNREACHABLE:
+                break
+            if b not in used_boxes and t not in used_targets:
+                used_boxes.add(b)
+                used_targets.add(t)
+                total += dist
+        if len(used_boxes) < len(boxes):
+            total = self.matching_cost(boxes)[0]
+        return total, tuple(boxes)
+
+    def greedy_matching_delta(self, h, cache, old, new):
+        # one moved box can reorder the whole greedy pass, so it is simply redone
+        boxes = list(cache)
+        boxes[boxes.index(old)] = new
+        return self.greedy_matching_cost(boxes)
+
+    def matching_cost(self, boxes):
+        """
+        Minimum total push distance over all assignments of boxes to distinct targets,
+        found with the Hungarian algorithm. Each push moves one box one cell closer at
+        best, so this never overestimates.
+        The cache holds the box cells (one row each), the row and column potentials and
+        the matching, which is what matching_delta needs to repair it after one push.
+        """
+        n = len(self.push_dist)
+        cost = [[dists[b] for dists in self.push_dist] for b in boxes]
+        u = [0] * (n + 1)  # row potentials
+        v = [0] * (n + 1)  # column potentials
+        match = [0] * (n + 1)  # match[j]: row assigned to column j, 1-based, 0 when free
+        way = [0] * (n + 1)
+        for i in range(1, n + 1):
+            self.augment(cost, u, v, match, way, i)
+        return self.matching_total(cost, match), (list(boxes), u, v, match)
+
+    def matching_delta(self, h, cache, old, new):
+        """
+        Re-solve the assignment after the box on `old` moved to `new`. Only that box's row
+        of costs changed, so its row potential is lowered until it is feasible again,
+        its target is freed and a single augmenting path restores the optimum in O(n^2).
+        """
+        boxes, u, v, match = cache
+        boxes = list(boxes)
+        u = list(u)
+        v = list(v)
+        match = list(match)
+        n = len(self.push_dist)
+        row = boxes.index(old)
+        boxes[row] = new
+        cost = [[dists[b] for dists in self.push_dist] for b in boxes]
+        i = row + 1
+        match[match.index(i, 1)] = 0
+        u[i] = min(cost[row][j - 1] - v[j] for j in range(1, n + 1))
+        self.augment(cost, u, v, match, [0] * (n + 1), i)
+        return self.matching_total(cost, match), (boxes, u, v, match)
+
+    def pattern_bound(self, h, boxes):
+        """
+        Raise a matching cost h to the pattern database bound for the box cells, if larger
+        """
+        if self.pattern_db is None:
+            self.pattern_db = pattern_db.PatternDatabase.load_or_build(self, self.pdb_dir, self.pdb_size, sys.stderr)
+        bound = self.pattern_db.lower_bound(boxes)
+        if bound is None:
+            return self.UNREACHABLE
+        return max(h, bound)
+
+    def pattern_cost(self, boxes):
+        # the matching cache is kept so the assignment is still repaired incrementally
+        h, cache = self.matching_cost(boxes)
+        return self.pattern_bound(h, boxes), cache
+
+    def pattern_delta(self, h, cache, old, new):
+        h, cache = self.matching_delta(h, cache, old, new)
+        return self.pattern_bound(h, cache[0]), cache
+
+    def augment(self, cost, u, v, match, way, i):
+        """
+        One phase of the Hungarian algorithm: assign the free row i along a shortest
+        augmenting path, keeping the potentials feasible
+        """
+        n = len(cost)
+        match[0] = i
+        j0 = 0
+        minv = [float('inf')] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            delta = float('inf')
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        # flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+        match[0] = 0
+
+    def matching_total(self, cost, match):
+        return sum(cost[match[j] - 1][j - 1] for j in range(1, len(match)))
+
     def calc_heuristicAstar(self, node):
-        mnhtn_dist = 0
-        for box in node.box_positions:
-            min_dis = self.x_size + self.y_size
-            for target in self.tgt_positions:
-                x = abs(box[0] - target[0]) + abs(box[1] - target[1])
-                if(x < min_dis):
-                    min_dis = x
-            mnhtn_dist += min_dis
-        node.setHeuristic(mnhtn_dist)
+        """
+        Full heuristic computation for a step-level node
+        """
+        node.heuristic, node.h_cache = self.box_heuristic(list(self.cells_of(node.boxes)))
+        return
+
+    def update_heuristic(self, node):
+        """
+        Incremental heuristic for a child node: start from the parent's value and cache and
+        account for the single box in node.pushed (no change at all when nothing was pushed).
+        With check_heuristic set, the result is asserted against a full recomputation.
+        """
+        parent = node.parent
+        if node.pushed is None:
+            node.heuristic, node.h_cache = parent.heuristic, parent.h_cache
+        else:
+            node.heuristic, node.h_cache = self.box_heuristic_delta(parent.heuristic, parent.h_cache, *node.pushed)
+        if self.check_heuristic:
+            full = self.box_heuristic(list(self.cells_of(node.boxes)))[0]
+            assert node.heuristic == full, "incremental heuristic %d != full %d" % (node.heuristic, full)
         return
     
+    def unsolvable(self, node):
+        """
+        True when the matching heuristics found no way to give every box its own reachable
+        target; such states are pruned (and counted with the dead square prunes) rather than
+        queued with an enormous f
+        """
+        if node.heuristic >= self.UNREACHABLE:
+            self.pruned_dead += 1
+            return True
+        return False
+
     def calc_heuristicUCS(self, node):
         return 0
+
+    def calc_heuristicPush(self, node):
+        node.heuristic, node.h_cache = self.box_heuristic(list(self.cells_of(node.boxes)))
+        return
     
     
     def done(self, node):
@@ -251,60 +812,267 @@ class SokobanMap:
                 solution.append(i.action)      
         return solution
 
+    def done_pushes(self, node):
+        """
+        Trace a push-level node back to the root and expand its pushes into player moves
+        """
+        pushes = []
+        while node.parent is not None:
+            pushes.append(node.action)
+            node = node.parent
+        pushes.reverse()
+        return self.expand_pushes(node.boxes, node.player, pushes)
+
     def render(self, node):
         """
         Render the map's current state to terminal
         """
-        for r in range(self.y_size):
-            line = ''
-            for c in range(self.x_size):
-                symbol = self.FREE_GLYPH
-                if self.obstacle_map[r][c] == self.OBSTACLE_SYMBOL:
-                    symbol = self.OBST_GLYPH
-                if (r, c) in self.tgt_positions:
-                    symbol = self.TGT_GLYPH
-                # box or player overwrites tgt
-                if (r, c) in node.box_positions:
-                    symbol = self.BOX_GLYPH
-                if node.player_x == c and node.player_y == r:
-                    symbol = self.PLAYER_GLYPH
-                line += symbol
-            print(line)
-
-        print('\n\n')
+        boxes = 0
+        for c in self.cells_of(node.boxes):
+            boxes |= 1 << self.board_cell[c]
+        self.board.render(boxes, self.board_cell[node.player])
 
     def is_finished(self, node):
-        finished = True
-        for i in node.box_positions:
-            if i not in self.tgt_positions:
-                finished = False
-        return finished
-    
+        return node.boxes == self.tgt_bits
+
+    # methods timed under each phase when profiling; table lookups count as hashing too. The
+    # external and batch searches call none of these, and time their own phases instead
+    PHASE_METHODS = {'moves': ('apply_move', 'push_children', 'pull_children'),
+                     'heuristic': ('calc_heuristicAstar', 'calc_heuristicPush', 'update_heuristic'),
+                     'hashing': ('push_state',)}
+
+    def begin_search(self, algorithm):
+        """
+        Start the instrumentation for one search. With profile set, the phase methods are
+        shadowed on this instance by timing wrappers until end_search (or end_profile).
+        :return: the SearchStats the search fills in
+        """
+        stats = SearchStats(algorithm, self.progress, self.progress_interval)
+        self.freed_nodes = 0
+        self.rss_base = self.rss_peak = resident_bytes() if self.memory_limit else None
+        self.rss_scale = 1.0
+        stats.pruned_dead = self.pruned_dead
+        stats.pruned_frozen = self.pruned_frozen
+        if self.profile:
+            stats.phase_time = dict.fromkeys(SearchStats.PHASES, 0.0)
+            for phase, names in self.PHASE_METHODS.items():
+                for name in names:
+                    setattr(self, name, timed(getattr(self, name), stats.phase_time, phase))
+        return stats
+
+    def new_table(self, size, stats):
+        """
+        TranspositionTable for a search, with its lookups timed as hashing when profiling
+        """
+        table = TranspositionTable(size)
+        if stats.phase_time is not None:
+            table.get = timed(table.get, stats.phase_time, 'hashing')
+            table.improve = timed(table.improve, stats.phase_time, 'hashing')
+        return table
+
+    def end_search(self, stats, solution, frontier, status=None):
+        """
+        Finish the instrumentation started by begin_search
+        :param solution: list of moves, or None if there is no solution
+        :param frontier: number of nodes left queued
+        :param status: see SearchStats.finish
+        :return: stats
+        """
+        self.end_profile(stats)
+        stats.pruned_dead = self.pruned_dead - stats.pruned_dead
+        stats.pruned_frozen = self.pruned_frozen - stats.pruned_frozen
+        return stats.finish(solution, frontier, status)
+
+    def end_profile(self, stats):
+        """
+        Remove the timing wrappers begin_search put on this instance, if they are still there
+        """
+        if stats.phase_time is not None:
+            for names in self.PHASE_METHODS.values():
+                for name in names:
+                    self.__dict__.pop(name, None)
+
+    def new_explored(self, stats):
+        """
+        Explored set for the best-first searches: the transposition table, or with
+        explored_backend 'fingerprint' a ClosedSet of fingerprints
+        """
+        if self.explored_backend != 'fingerprint':
+            return self.new_table(self.table_size(self.tt_size), stats)
+        return self.new_closed_set(stats)
+
+    def new_closed_set(self, stats):
+        table = ClosedSet(bloom_bits=self.bloom_bits)
+        if stats.phase_time is not None:
+            table.get = timed(table.get, stats.phase_time, 'hashing')
+            table.improve = timed(table.improve, stats.phase_time, 'hashing')
+        return table
+
+    def shrink_explored(self, stats, table):
+        """
+        Second step of degrading under the memory limit, once dropping frontier nodes is not
+        enough (see over_budget): replace a transposition table, which reserves its memory up
+        front, with a ClosedSet of fingerprints that only grows with the states expanded from
+        here on. States the table had already seen may be expanded once more.
+        :return: the new explored set, or None if it already is a ClosedSet
+        """
+        if isinstance(table, ClosedSet):
+            return None
+        self.record_explored(stats, table)
+        return self.new_closed_set(stats)
+
+    def record_explored(self, stats, table):
+        # a table replaced by shrink_explored has already recorded its count
+        stats.explored = max(stats.explored, table.count)
+        stats.collision_probability = table.collision_probability()
+
+    def table_size(self, size):
+        """
+        Transposition table entries for a search: `size`, cut down so that the table takes no
+        more than a quarter of the memory limit. The cut is rounded down to a power of two,
+        since TranspositionTable rounds any other size up.
+        """
+        if self.memory_limit:
+            cap = max(self.memory_limit // 4 // TranspositionTable.ENTRY_BYTES, 2)
+            size = min(size, 1 << (cap.bit_length() - 1))
+        return size
+
+    def node_bytes(self, node):
+        """
+        Estimated bytes held by one search node: the node itself, the values every move
+        replaces, the reference to it in the frontier and, if it pushed a box, its heuristic
+        cache (a walk shares the parent's). The matching caches hold four lists per node
+        and are most of a pushed node's size.
+        """
+        size = sys.getsizeof(node) + sys.getsizeof(node.boxes) + 8
+        zkey = getattr(node, 'zkey', None)  # the bidirectional search's pull nodes have none
+        if zkey is not None:
+            size += sys.getsizeof(zkey)
+        if node.pushed is not None and node.h_cache is not None:
+            size += sys.getsizeof(node.h_cache)
+            for part in node.h_cache:
+                if isinstance(part, (list, tuple)):
+                    size += sys.getsizeof(part) + sum(sys.getsizeof(value) for value in part if value > 256)
+        return size
+
+    def calibrate(self, estimate, exact):
+        """
+        Scale a structure estimate (bytes) to the memory the search really holds. The
+        estimate misses allocator overhead and short-lived lists, and node_bytes charges
+        every node with its sample node's heuristic cache. So whenever the process reaches
+        a new peak resident size, the growth since begin_search is measured: the scale
+        returned then makes the estimate at least that growth and, for an `exact` estimate
+        (one that counts the live nodes, not an upper bound), the ratio becomes rss_scale
+        for the checks in between. Only new peaks count, because memory freed by dropping
+        nodes stays resident for reuse and would otherwise read as still in use.
+        """
+        rss = resident_bytes() if self.rss_base is not None else None
+        if rss is None or rss <= self.rss_peak or estimate <= 0:
+            return self.rss_scale
+        self.rss_peak = rss
+        scale = (rss - self.rss_base) / estimate
+        if exact:
+            self.rss_scale = max(self.MIN_RSS_SCALE, scale)
+        return max(self.rss_scale, scale)
+
+    def live_nodes(self, frontier, held=()):
+        """
+        Number of search nodes a frontier (and any other nodes `held` by the search) keeps
+        alive: those nodes and every node on the path to one of them. Other expanded nodes
+        are only held through their children, so once none of those is queued they have
+        been freed.
+        """
+        seen = set()
+        for node in itertools.chain(frontier, held):
+            while node is not None and id(node) not in seen:
+                seen.add(id(node))
+                node = node.parent
+        return len(seen)
+
+    def over_budget(self, stats, node, nodes, frontier=None, table=None, entry_bytes=0, keys=None, held=()):
+        """
+        Memory check, run by the searches every SearchStats.CHECK_EVERY expansions while a
+        memory limit is set. Memory is estimated per structure: search nodes (node_bytes of
+        `node` for each of `nodes`), state keys (the transposition table, or entry_bytes per
+        entry of the search's dicts and sets: `keys` of them, by default one per node) and
+        the frontier's buckets and indexes. `held` is any other collection of nodes the
+        search keeps. Every figure is scaled by calibrate, so the total follows the
+        process's measured resident growth.
+
+        With a frontier, `nodes` (queued plus expanded) is an upper bound: once it goes past
+        the limit the nodes still alive are counted (live_nodes), and the difference is
+        remembered in freed_nodes, since a freed node never comes back. Dropping the worst
+        frontier entries frees the dropped nodes at least, so they are dropped until the
+        estimate is back under LOW_WATER of the limit. When even dropping every queued node
+        cannot get there, nothing is dropped: the search moves to a smaller explored set
+        (shrink_explored) or, if it has none, stops.
+        :return: True if dropping frontier nodes is not enough
+        """
+        node_bytes = self.node_bytes(node)
+        queued = len(frontier) if frontier is not None else 0
+        if frontier is not None:
+            nodes -= self.freed_nodes
+        if keys is None:
+            keys = nodes
+        memory = {'nodes': nodes * node_bytes,
+                  'state_keys': table.memory() if table is not None else keys * entry_bytes,
+                  'frontier': frontier.memory() if frontier is not None else 0}
+        exact = frontier is None  # else nodes is an upper bound until the live ones are counted
+        if frontier is not None and self.rss_scale * sum(memory.values()) > self.memory_limit:
+            live = self.live_nodes(frontier, held)
+            self.freed_nodes += nodes - live
+            memory['nodes'] = live * node_bytes
+            exact = True
+        scale = self.calibrate(sum(memory.values()), exact)
+        node_bytes = int(scale * node_bytes)
+        memory = {name: int(scale * size) for name, size in memory.items()}
+        total = sum(memory.values())
+        if stats.memory is None or total > sum(stats.memory.values()):
+            stats.memory = memory
+        if total <= self.memory_limit:
+            return False
+        low_water = int(self.LOW_WATER * self.memory_limit)
+        if total - queued * node_bytes > low_water:
+            return True
+        stats.dropped += frontier.drop_worst((total - low_water) // node_bytes + 1)
+        return False
 
-    
     def Astar(self):
-        start = time.time()
-        frontier = []# queue of found but unvisited nodes, FIFO
-        heapq.heapify(frontier)
-        heapq.heappush(frontier, self.rootNode)
-        frontier_max_size = len(frontier)  # We measure space / memory requirements of the algo via this metric.
-        ft = set()
-        ft.add(self.rootNode.get_state_wp())
-        explored = set([])
-        ct = 0
-        self.rootNode.setHeuristic(self.calc_heuristicAstar(self.rootNode))
+        stats = self.begin_search('astar')
+        self.calc_heuristicAstar(self.rootNode)
+        if self.unsolvable(self.rootNode):
+            return self.end_search(stats, None, 0)
+        frontier = BucketQueue(keyed=True)# found but unvisited nodes, lowest f (then h) first
+        frontier.push(self.rootNode, self.rootNode.heuristic, self.rootNode.heuristic)
+        stats.frontier_max = len(frontier)  # We measure space / memory requirements of the algo via this metric.
+        # best g-cost seen per state; replaces the explored and frontier sets
+        table = self.new_explored(stats)
+        table.improve(self.rootNode.zkey, 0)
         while len(frontier) != 0:
 
-            if len(frontier) > frontier_max_size: frontier_max_size = len(frontier)
+            if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
 
-            current_node = heapq.heappop(frontier) # select and remove the first node in the queue
+            current_node = frontier.pop() # select and remove the first node in the queue
 
-            ft.remove(tuple(current_node.get_state_wp()))
-            explored.add(tuple(current_node.get_state_wp()))         
+            # the state was expanded on a path at least as cheap (a reopened state, or the
+            # fingerprint backend's closed set)
+            best = table.get(current_node.zkey)
+            if best is not None and best < current_node.depth:
+                continue
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(frontier), frontier.min_f)
+                if self.memory_limit and self.over_budget(stats, current_node, len(frontier) + stats.expanded,
+                                                          frontier, table):
+                    closed = self.shrink_explored(stats, table)
+                    if closed is None:
+                        self.record_explored(stats, table)
+                        return self.end_search(stats, None, len(frontier), 'memory budget')
+                    table = closed
             
             if (self.is_finished(current_node)):
-                solution = self.done(current_node)
-                return [-start + time.time(), len(explored), len(frontier), solution]
+                self.record_explored(stats, table)
+                return self.end_search(stats, self.done(current_node), len(frontier))
             
             actions = ['u', 'd', 'r', 'l']
 
@@ -312,38 +1080,57 @@ class SokobanMap:
                 new_node = Node(current_node, anaction, current_node.depth+1)
                 new_node.populateChild(current_node)
                 if(self.apply_move(anaction, new_node)):
-                    self.calc_heuristicAstar(new_node)
-                    self.set_state_wp(new_node)
-                    if tuple(new_node.get_state_wp()) not in explored:
-                        if tuple(new_node.get_state_wp()) not in ft:
-                            heapq.heappush(frontier, new_node)
-                            ft.add(tuple(new_node.get_state_wp()))
+                    stats.generated += 1
+                    # new state, or one reached more cheaply than before: a costlier node still
+                    # queued for it is replaced (decrease-key), an expanded one is reopened
+                    queued = frontier.get(new_node.zkey)
+                    if (queued is not None and queued.depth <= new_node.depth) \
+                            or not table.improve(new_node.zkey, new_node.depth):
+                        stats.duplicates += 1
+                        continue
+                    self.update_heuristic(new_node)
+                    if self.unsolvable(new_node):
+                        continue
+                    f = new_node.depth + new_node.heuristic
+                    if queued is not None:
+                        frontier.decrease_key(queued, new_node, f, new_node.heuristic)
+                    else:
+                        frontier.push(new_node, f, new_node.heuristic)
                 
-        return False
+        self.record_explored(stats, table)
+        return self.end_search(stats, None, 0)
     
     def UCS(self):
-        start = time.time()
-        frontier = []# queue of found but unvisited nodes, FIFO
-        heapq.heapify(frontier)
-        heapq.heappush(frontier, self.rootNode)
-        frontier_max_size = len(frontier)  # We measure space / memory requirements of the algo via this metric.
-        ft = set()
-        ft.add(self.rootNode.get_state_wp())
-        explored = set([])
-        ct = 0
+        stats = self.begin_search('ucs')
+        frontier = BucketQueue(keyed=True)# found but unvisited nodes, lowest depth first
+        frontier.push(self.rootNode, 0, 0)
+        stats.frontier_max = len(frontier)  # We measure space / memory requirements of the algo via this metric.
+        table = self.new_explored(stats)
+        table.improve(self.rootNode.zkey, 0)
         self.rootNode.setHeuristic(self.calc_heuristicUCS(self.rootNode))
         while len(frontier) != 0:
 
-            if len(frontier) > frontier_max_size: frontier_max_size = len(frontier)
+            if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
 
-            current_node = heapq.heappop(frontier) # select and remove the first node in the queue
+            current_node = frontier.pop() # select and remove the first node in the queue
 
-            ft.remove(tuple(current_node.get_state_wp()))
-            explored.add(tuple(current_node.get_state_wp()))         
+            best = table.get(current_node.zkey)
+            if best is not None and best < current_node.depth:
+                continue
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(frontier), frontier.min_f)
+                if self.memory_limit and self.over_budget(stats, current_node, len(frontier) + stats.expanded,
+                                                          frontier, table):
+                    closed = self.shrink_explored(stats, table)
+                    if closed is None:
+                        self.record_explored(stats, table)
+                        return self.end_search(stats, None, len(frontier), 'memory budget')
+                    table = closed
             
             if (self.is_finished(current_node)):
-                solution = self.done(current_node)
-                return [-start + time.time(), len(explored), len(frontier), solution]
+                self.record_explored(stats, table)
+                return self.end_search(stats, self.done(current_node), len(frontier))
             
             actions = ['u', 'd', 'r', 'l']
 
@@ -352,15 +1139,468 @@ class SokobanMap:
                 new_node.populateChild(current_node)
                 
                 if(self.apply_move(anaction, new_node)):
-                    self.calc_heuristicUCS(new_node)
-                    self.set_state_wp(new_node)
-                    if tuple(new_node.get_state_wp()) not in explored:
-                        if tuple(new_node.get_state_wp()) not in ft:
-                            heapq.heappush(frontier, new_node)
-                            ft.add(tuple(new_node.get_state_wp()))
+                    stats.generated += 1
+                    queued = frontier.get(new_node.zkey)
+                    if (queued is not None and queued.depth <= new_node.depth) \
+                            or not table.improve(new_node.zkey, new_node.depth):
+                        stats.duplicates += 1
+                    elif queued is not None:
+                        frontier.decrease_key(queued, new_node, new_node.depth, 0)
+                    else:
+                        frontier.push(new_node, new_node.depth, 0)
                 
 
-        return len(explored)
+        self.record_explored(stats, table)
+        return self.end_search(stats, None, 0)
+
+    def ARAstar(self, weight=None, step=None, deadline=None):
+        """
+        Anytime repairing A* (ARA*) over single player steps. Nodes are ordered by
+        g + weight * h, so the first pass finds a solution quickly; each later pass lowers
+        the weight by `step` and carries on from the previous open list, g-values and the
+        nodes whose g improved after they were expanded (INCONS), rather than starting
+        over. It ends once a pass at weight 1 completes, the bound reaches 1, the deadline
+        passes or the search runs out of its memory limit (see over_budget).
+
+        A generator: every time the solution or its bound improves it yields
+        (solution, bound), where the solution is at most `bound` times the optimal length.
+        Once frontier nodes have been dropped for memory the bound is unknown, and None.
+        Its return value is the SearchStats of the best solution. Profiling wrappers are
+        removed when the generator is closed, even if it never reaches end_search.
+        :param weight, step, deadline: default to ara_weight, ara_step and deadline
+        """
+        scale = self.WEIGHT_SCALE
+        weight = int(round(scale * (self.ara_weight if weight is None else weight)))
+        step = max(int(round(scale * (self.ara_step if step is None else step))), 1)
+        deadline = self.deadline if deadline is None else deadline
+        stats = self.begin_search('ara')
+        try:
+            end = stats.start + deadline if deadline is not None else None
+            root = self.rootNode
+            self.calc_heuristicAstar(root)
+            if self.unsolvable(root):
+                return self.end_search(stats, None, 0)
+            best_g = {root.zkey: 0}
+            closed = set()
+
+            # the state lookups, kept in functions so that profiling can time them as hashing
+            def stale(node):
+                return best_g[node.zkey] < node.depth
+
+            def improve(node):
+                old = best_g.get(node.zkey)
+                if old is not None and old <= node.depth:
+                    return False
+                best_g[node.zkey] = node.depth
+                return True
+
+            def close(node):
+                closed.add(node.zkey)
+
+            def is_closed(node):
+                return node.zkey in closed
+
+            if stats.phase_time is not None:
+                stale, improve, close, is_closed = (timed(f, stats.phase_time, 'hashing')
+                                                    for f in (stale, improve, close, is_closed))
+            frontier = BucketQueue()
+            frontier.push(root, max(weight, scale) * root.heuristic, root.heuristic)
+            incons = []
+            incumbent = None
+            reported = None  # (length, bound) last yielded
+            bound = None
+            timed_out = False
+            out_of_memory = False
+            while True:
+                weight = max(weight, scale)
+                closed.clear()
+                while frontier:
+                    if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
+                    node = frontier.pop()
+                    if stale(node):
+                        continue
+                    priority = node.depth * scale + weight * node.heuristic
+                    if incumbent is not None and priority >= incumbent.depth * scale:
+                        # nothing left in this pass can improve on the solution
+                        frontier.push(node, priority, node.heuristic)
+                        break
+                    close(node)
+                    stats.expanded += 1
+                    if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                        stats.checkpoint(len(frontier), weight / scale)
+                        if end is not None and time.perf_counter() > end:
+                            frontier.push(node, priority, node.heuristic)
+                            timed_out = True
+                            break
+                        nodes = len(frontier) + len(incons) + stats.expanded
+                        if self.memory_limit and self.over_budget(stats, node, nodes, frontier,
+                                                                  entry_bytes=self.DICT_ENTRY_BYTES,
+                                                                  keys=len(best_g) + len(closed), held=incons):
+                            frontier.push(node, priority, node.heuristic)
+                            out_of_memory = True
+                            break
+                    if self.is_finished(node):
+                        if incumbent is None or node.depth < incumbent.depth:
+                            incumbent = node
+                        continue
+                    for anaction in ['u', 'd', 'r', 'l']:
+                        new_node = Node(node, anaction, node.depth + 1)
+                        new_node.populateChild(node)
+                        if not self.apply_move(anaction, new_node):
+                            continue
+                        stats.generated += 1
+                        if not improve(new_node):
+                            stats.duplicates += 1
+                            continue
+                        self.update_heuristic(new_node)
+                        if self.unsolvable(new_node):
+                            continue
+                        if is_closed(new_node):
+                            incons.append(new_node)
+                        else:
+                            frontier.push(new_node, new_node.depth * scale + weight * new_node.heuristic,
+                                          new_node.heuristic)
+
+                # every node that could still lead to a shorter solution is open or inconsistent
+                waiting = [node for node in list(frontier) + incons if best_g[node.zkey] == node.depth]
+                if incumbent is not None:
+                    if stats.dropped:
+                        # a dropped node might have led to a shorter solution, so nothing is proven
+                        bound = None
+                    else:
+                        lower = min((node.depth + node.heuristic for node in waiting), default=None)
+                        bound = weight / scale
+                        if lower is None or lower >= incumbent.depth:
+                            bound = 1.0
+                        elif lower > 0:
+                            bound = max(1.0, min(bound, incumbent.depth / lower))
+                    report = (incumbent.depth, bound if bound is not None else float('inf'))
+                    if reported is None or report < reported:
+                        reported = report
+                        stats.suboptimality = bound
+                        yield self.done(incumbent), bound
+                if timed_out or out_of_memory or weight == scale or bound == 1.0 or not waiting:
+                    break
+                # next pass: lower the weight and reorder the open and inconsistent nodes by it
+                weight -= step
+                frontier = BucketQueue()
+                for node in waiting:
+                    frontier.push(node, node.depth * scale + max(weight, scale) * node.heuristic, node.heuristic)
+                incons = []
+
+            stats.explored = len(best_g)
+            if incumbent is None:
+                status = 'memory budget' if out_of_memory else 'deadline' if timed_out else None
+                return self.end_search(stats, None, len(frontier), status)
+            return self.end_search(stats, self.done(incumbent), len(frontier))
+        finally:
+            # a caller may stop iterating early, and end_search never runs
+            self.end_profile(stats)
+
+    def AnytimeAstar(self):
+        """
+        Run ARAstar to the end and return its SearchStats. Each improvement is reported on
+        the progress stream, if there is one.
+        """
+        search = self.ARAstar()
+        start = time.perf_counter()
+        while True:
+            try:
+                solution, bound = next(search)
+            except StopIteration as stop:
+                return stop.value
+            if self.progress is not None:
+                self.progress.write(json.dumps({'event': 'solution', 'elapsed': time.perf_counter() - start,
+                                                'length': len(solution), 'bound': bound}) + '\n')
+                self.progress.flush()
+
+    def ExternalBFS(self):
+        """
+        Breadth-first search over single player steps with the frontier layers and the
+        explored set kept in sorted, compressed run files on disk (see external_search.py),
+        for levels whose state space does not fit in memory. Resident memory is bounded
+        by spill_states; the solution is optimal in steps.
+        """
+        stats = self.begin_search('external')
+        solution = external_search.layered_bfs(self, stats, self.spill_dir, self.spill_states)
+        return self.end_search(stats, solution, 0)
+
+    def BatchAstar(self):
+        """
+        A* over single player steps that pops a block of states with the same f and expands
+        it with NumPy array operations (see batch_search.py). The heuristic is 'manhattan'
+        when that is selected; otherwise it is each box's push distance to its nearest target,
+        since the matching heuristics do not vectorise. Needs NumPy.
+        """
+        stats = self.begin_search('batch')
+        solution, queued, status = batch_search.batched_search(self, stats, True, self.batch_size)
+        stats.collision_probability = collision_probability(stats.explored)
+        return self.end_search(stats, solution, queued, status)
+
+    def BatchUCS(self):
+        """
+        BatchAstar without a heuristic: a breadth-first search whose layers are expanded a
+        block at a time
+        """
+        stats = self.begin_search('batch-ucs')
+        solution, queued, status = batch_search.batched_search(self, stats, False, self.batch_size)
+        stats.collision_probability = collision_probability(stats.explored)
+        return self.end_search(stats, solution, queued, status)
+
+    def IDAstar(self):
+        """
+        Iterative-deepening A* over single player steps: repeated depth-first searches, each
+        cut off where depth + heuristic exceeds a bound that grows to the smallest f seen past
+        the previous cut. Memory is the current path (checked for cycles) plus, if
+        ida_tt_size is non-zero, a small transposition table that skips states already
+        reached at no greater depth in the same iteration.
+        """
+        stats = self.begin_search('ida')
+        root = self.rootNode
+        self.calc_heuristicAstar(root)
+        if self.unsolvable(root):
+            return self.end_search(stats, None, 0)
+        bound = root.heuristic
+        on_path = set([root.zkey])
+        actions = ['u', 'd', 'r', 'l']
+
+        def search(table):
+            """
+            One bounded depth-first pass from the root. The path is an explicit stack of
+            (node, moves not yet tried), so solutions of any length stay within Python's
+            recursion limit.
+            :return: the goal node reached, or None
+            """
+            nonlocal next_bound
+            stack = []
+            node = root
+            while True:
+                f = node.depth + node.heuristic
+                if f > bound:
+                    if f < next_bound:
+                        next_bound = f
+                    on_path.discard(node.zkey)
+                elif self.is_finished(node):
+                    return node
+                else:
+                    stats.expanded += 1
+                    if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                        stats.checkpoint(0, bound)  # nothing is queued, only the current path is kept
+                    stack.append((node, iter(actions)))
+
+                # the next child to visit: the first acceptable move left at the deepest level
+                node = None
+                while stack and node is None:
+                    parent, moves = stack[-1]
+                    for anaction in moves:
+                        new_node = Node(parent, anaction, parent.depth + 1)
+                        new_node.populateChild(parent)
+                        if not self.apply_move(anaction, new_node):
+                            continue
+                        stats.generated += 1
+                        if new_node.zkey in on_path or (table is not None and
+                                                        not table.improve(new_node.zkey, new_node.depth)):
+                            stats.duplicates += 1
+                            continue
+                        self.update_heuristic(new_node)
+                        if self.unsolvable(new_node):
+                            continue
+                        on_path.add(new_node.zkey)
+                        node = new_node
+                        break
+                    else:
+                        stack.pop()
+                        if parent is not root:
+                            on_path.discard(parent.zkey)
+                if node is None:
+                    return None
+
+        while True:
+            next_bound = float('inf')
+            table = None
+            if self.ida_tt_size:
+                # depths stored in one iteration say nothing about the next bound
+                table = self.new_table(self.ida_tt_size, stats)
+                table.improve(root.zkey, 0)
+            found = search(table)
+            if table is not None and table.count > stats.explored:
+                stats.explored = table.count
+            if found is not None:
+                return self.end_search(stats, self.done(found), 0)
+            if next_bound == float('inf'):
+                return self.end_search(stats, None, 0)
+            bound = next_bound
+
+    def Bidirectional(self):
+        """
+        Bidirectional breadth-first search over box pushes. A forward push search from the
+        start meets a backward pull search from the solved positions; both sides key states
+        the same way (push_state), so a meeting is a dict lookup. The two halves are
+        stitched into one list of pushes and expanded into player moves. Each step expands
+        the side with the smaller queue. Solutions are found quickly, but are not optimal.
+        The result's directions hold expanded counts and time per direction.
+        """
+        stats = self.begin_search('bidir')
+        root = self.push_root()
+        directions = {'forward': {'expanded': 0, 'time': 0.0}, 'backward': {'expanded': 0, 'time': 0.0}}
+        stats.directions = directions
+        if root.boxes == self.tgt_bits:
+            return self.end_search(stats, [], 0)
+        forward = {self.push_state(root): root}
+        backward = {}
+        forward_queue = deque([root])
+        backward_queue = deque()
+        for pull_root in self.pull_roots():
+            backward[self.push_state(pull_root)] = pull_root
+            backward_queue.append(pull_root)
+
+        meeting = self.push_state(root) if self.push_state(root) in backward else None
+        stats.frontier_max = len(forward_queue) + len(backward_queue)
+        while meeting is None and forward_queue and backward_queue:
+            stats.frontier_max = max(stats.frontier_max, len(forward_queue) + len(backward_queue))
+            if len(forward_queue) <= len(backward_queue):
+                side, seen, other, queue, children = 'forward', forward, backward, forward_queue, self.push_children
+            else:
+                side, seen, other, queue, children = 'backward', backward, forward, backward_queue, self.pull_children
+            side_start = time.time()
+            node = queue.popleft()
+            directions[side]['expanded'] += 1
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(forward_queue) + len(backward_queue))
+                # every node seen stays in one of the dicts, so there is nothing to drop
+                if self.memory_limit and self.over_budget(stats, node, len(forward) + len(backward),
+                                                          entry_bytes=self.DICT_ENTRY_BYTES):
+                    stats.explored = len(forward) + len(backward)
+                    return self.end_search(stats, None, len(forward_queue) + len(backward_queue), 'memory budget')
+            for new_node in children(node):
+                stats.generated += 1
+                state = self.push_state(new_node)
+                if state in seen:
+                    stats.duplicates += 1
+                else:
+                    seen[state] = new_node
+                    queue.append(new_node)
+                    if state in other:
+                        meeting = state
+                        break
+            directions[side]['time'] += time.time() - side_start
+
+        stats.explored = len(forward) + len(backward)
+        if meeting is None:
+            return self.end_search(stats, None, 0)
+        pushes = []
+        node = forward[meeting]
+        while node.parent is not None:
+            pushes.append(node.action)
+            node = node.parent
+        pushes.reverse()
+        node = backward[meeting]
+        while node.parent is not None:
+            pushes.append(node.action)
+            node = node.parent
+        solution = self.expand_pushes(root.boxes, root.player, pushes)
+        return self.end_search(stats, solution, len(forward_queue) + len(backward_queue))
+
+    # search name -> method, as chosen on the command line
+    SEARCHES = {'astar': 'Astar', 'ucs': 'UCS', 'push': 'AstarPush', 'ida': 'IDAstar', 'bidir': 'Bidirectional',
+                'ara': 'AnytimeAstar', 'external': 'ExternalBFS', 'batch': 'BatchAstar', 'batch-ucs': 'BatchUCS'}
+
+    def search(self, algorithm, cache=None, verify=False):
+        """
+        Run one of the searches by name, answering from a level_cache.LevelCache when it
+        holds a result for this level, search and heuristic. Fresh results are stored back
+        when they are final (see SearchStats.final), so a result cut short by the memory
+        limit or an anytime deadline is never served to a later run.
+        :param verify: replay a cached solution through apply_move before trusting it;
+                       an entry that fails is searched again and overwritten
+        """
+        if cache is not None:
+            start = time.perf_counter()
+            fields = cache.get_solution(self, algorithm)
+            if fields is not None and (not verify or fields['solution'] is None or self.replay(fields['solution'])):
+                stats = SearchStats.from_dict(fields)
+                if stats.final():  # entries from before final() was checked may not be
+                    stats.cached = True
+                    stats.time = time.perf_counter() - start
+                    return stats
+        stats = getattr(self, self.SEARCHES[algorithm])()
+        if cache is not None and stats.final():
+            cache.put_solution(self, algorithm, stats.as_dict())
+        return stats
+
+    def replay(self, moves):
+        """
+        True if the moves, applied one by one from the initial state, solve the level
+        """
+        return self.board.replay(moves)
+
+    def push_root(self):
+        """
+        Root node for the push-level searches
+        """
+        root = Node()
+        root.boxes = self.rootNode.boxes
+        root.player = self.rootNode.player
+        root.zkey = self.rootNode.zkey
+        return root
+
+    def AstarPush(self):
+        """
+        A* over box pushes rather than single player steps. Walking without pushing never
+        creates a new state: each child is a push the player can reach, costed as the walk
+        plus the push, and the walks are filled back in once a solution is found.
+        States are keyed on the boxes and the player's exact cell after the push, so g is the
+        true number of moves and a cheaper walk to a state already seen reopens it; the
+        solution is optimal in moves, like astar's, whenever the heuristic is admissible.
+        """
+        stats = self.begin_search('push')
+        root = self.push_root()
+        self.calc_heuristicPush(root)
+        if self.unsolvable(root):
+            return self.end_search(stats, None, 0)
+        goal = self.goal_state()
+        frontier = BucketQueue()
+        frontier.push(root, root.heuristic, root.heuristic)
+        stats.frontier_max = len(frontier)
+        table = self.new_explored(stats)
+        table.improve(root.zkey, 0)
+        while len(frontier) != 0:
+
+            if len(frontier) > stats.frontier_max: stats.frontier_max = len(frontier)
+
+            current_node = frontier.pop()
+
+            best = table.get(current_node.zkey)
+            if best is not None and best < current_node.depth:
+                continue
+            stats.expanded += 1
+            if not stats.expanded & (SearchStats.CHECK_EVERY - 1):
+                stats.checkpoint(len(frontier), frontier.min_f)
+                if self.memory_limit and self.over_budget(stats, current_node, len(frontier) + stats.expanded,
+                                                          frontier, table):
+                    closed = self.shrink_explored(stats, table)
+                    if closed is None:
+                        self.record_explored(stats, table)
+                        return self.end_search(stats, None, len(frontier), 'memory budget')
+                    table = closed
+
+            if current_node.boxes == goal:
+                self.record_explored(stats, table)
+                return self.end_search(stats, self.done_pushes(current_node), len(frontier))
+
+            for new_node in self.push_children(current_node):
+                stats.generated += 1
+                if table.improve(new_node.zkey, new_node.depth):
+                    self.update_heuristic(new_node)
+                    if self.unsolvable(new_node):
+                        continue
+                    frontier.push(new_node, new_node.depth + new_node.heuristic, new_node.heuristic)
+                else:
+                    stats.duplicates += 1
+
+        self.record_explored(stats, table)
+        return self.end_search(stats, None, 0)
     
     
 class Node:
@@ -369,53 +1609,661 @@ class Node:
     
     @author: Angus
     """
+    # no per-node __dict__: a child is a handful of references to (mostly shared) immutable values
+    __slots__ = ('parent', 'action', 'depth', 'heuristic',
+                 'boxes', 'player',  # packed boxes (see SokobanMap.box_key) and player cell index
+                 'h_cache', 'pushed',  # heuristic's per-box cache, and (from, to) cells of a pushed box
+                 'zkey')  # Zobrist hash of the state
+
     def __init__(self, parent=None, action=None, depth=0):
         self.parent = parent  # parent node, a NODE! not just a matrix.
         self.action = action  # The one that led to this node (useful for retracing purpose)
         self.depth = depth  # depth of the node in the tree. This is the criterion for who's next in DFS, BFS.
+        self.heuristic = 0
+        self.h_cache = None
+        self.pushed = None
         
     
     def populateChild(self, node):
-        self.setState(node.state)
-        self.setHeuristic(node.heuristic)
-        self.setBox_positions(node.box_positions)
-        self.setPlayer_position(node.player_position)
+        # the state is a few immutable ints, shared with the parent until apply_move replaces them
+        self.heuristic = node.heuristic
+        self.h_cache = node.h_cache
+        self.zkey = node.zkey
+        self.boxes = node.boxes
+        self.player = node.player
     
-    def setState(self, state):
-        self.state = copy.deepcopy(state)
-        
     def setHeuristic(self, heuristic):
-        self.heuristic = copy.deepcopy(heuristic)
+        self.heuristic = heuristic
     
-    def setBox_positions(self, box_positions):
-        self.box_positions = copy.deepcopy(box_positions)
-        
-        
-    def setPlayer_position(self, player_position):
-        self.player_position = copy.deepcopy(player_position)
-        self.player_x = self.player_position[1]
-        self.player_y = self.player_position[0]
-        
-    def get_state_wp(self):
-        return self.state
-    
-    def __lt__(self, other):
-        return (self.depth + self.heuristic) < (other.depth + other.heuristic)                         
-                
+
+class TranspositionTable:
+    """
+    Fixed-capacity table of the best g-cost seen for each state, keyed by 64-bit Zobrist hash.
+    Slots live in two flat arrays and are found by a short linear probe from the hash; when
+    every slot in the probe window is taken, the one holding the largest g is overwritten, so
+    the table never grows. An overwritten state may be generated and expanded again later.
+    """
+    DEFAULT_SIZE = 1 << 20
+    PROBES = 4
+    ENTRY_BYTES = 12  # 8 byte key + 4 byte cost
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """
+        :param size: number of entries, rounded up to a power of two
+        """
+        size = 1 << max(size - 1, 1).bit_length()
+        self.mask = size - 1
+        self.keys = array('Q', bytes(8 * size))
+        self.costs = array('i', [-1]) * size  # -1 marks an empty slot
+        self.count = 0
+
+    def memory(self):
+        """
+        Bytes held by the table's arrays
+        """
+        return len(self.keys) * self.keys.itemsize + len(self.costs) * self.costs.itemsize
+
+    def get(self, key):
+        """
+        :return: best g-cost stored for key, or None if it is not in the table
+        """
+        for i in range(self.PROBES):
+            slot = (key + i) & self.mask
+            if self.costs[slot] < 0:
+                return None
+            if self.keys[slot] == key:
+                return self.costs[slot]
+        return None
+
+    def improve(self, key, g):
+        """
+        Record g for key if it beats the stored cost (or the key is new).
+        :return: True if the entry was recorded, False if an equal or cheaper cost was already stored
+        """
+        victim = None
+        for i in range(self.PROBES):
+            slot = (key + i) & self.mask
+            cost = self.costs[slot]
+            if cost < 0:
+                self.keys[slot] = key
+                self.costs[slot] = g
+                self.count += 1
+                return True
+            if self.keys[slot] == key:
+                if cost <= g:
+                    return False
+                self.costs[slot] = g
+                return True
+            if victim is None or cost > self.costs[victim]:
+                victim = slot
+        self.keys[victim] = key
+        self.costs[victim] = g
+        return True
+
+    def collision_probability(self):
+        return collision_probability(self.count)
+
+
+def collision_probability(count):
+    """
+    Chance that two of `count` distinct states share a 64-bit fingerprint, so that one of
+    them is wrongly taken for the other (birthday bound, accurate while it is small)
+    """
+    return min(1.0, count * (count - 1) / 2.0 ** 65)
+
+
+class FingerprintSet:
+    """
+    Set of 64-bit state fingerprints. Fingerprints live in one preallocated array('Q') of
+    eight byte slots and are found by linear probing from their low bits; 0 marks an empty
+    slot, so a fingerprint of 0 is stored as 1. The array doubles once it is MAX_LOAD full
+    (so a state costs 11 to 21 bytes), and nothing is ever evicted.
+
+    With bloom_bits set, a Bloom filter of that many bits sits in front of the array: most
+    lookups of fingerprints that were never added stop there without probing.
+    """
+    DEFAULT_SIZE = 1 << 16
+    MAX_LOAD = 0.75
+    BLOOM_SHIFTS = (0, 21, 42)  # one filter bit per rotation of the fingerprint
+
+    def __init__(self, size=DEFAULT_SIZE, bloom_bits=0):
+        """
+        :param size: initial number of slots, rounded up to a power of two
+        :param bloom_bits: Bloom filter size in bits, rounded up to a power of two; 0 for none
+        """
+        size = 1 << max(size - 1, 1).bit_length()
+        self.mask = size - 1
+        self.slots = array('Q', bytes(8 * size))
+        self.count = 0
+        self.limit = int(self.MAX_LOAD * size)
+        self.bloom = None
+        if bloom_bits:
+            bloom_bits = 1 << max(bloom_bits - 1, 8).bit_length()
+            self.bloom = bytearray(bloom_bits // 8)
+            self.bloom_mask = bloom_bits - 1
+        self.bloom_rejects = 0  # lookups answered by the Bloom filter alone
+
+    def __len__(self):
+        return self.count
+
+    def memory(self):
+        """
+        Bytes held by the slot array and the Bloom filter
+        """
+        return len(self.slots) * self.slots.itemsize + (len(self.bloom) if self.bloom is not None else 0)
+
+    def bloom_bits_of(self, key):
+        # Zobrist keys are uniformly random, so rotations of one key are as good as separate hashes
+        mask = self.bloom_mask
+        return [((key >> shift) | (key << (64 - shift))) & mask for shift in self.BLOOM_SHIFTS]
+
+    def __contains__(self, key):
+        key = key or 1
+        if self.bloom is not None:
+            bloom = self.bloom
+            for bit in self.bloom_bits_of(key):
+                if not bloom[bit >> 3] & (1 << (bit & 7)):
+                    self.bloom_rejects += 1
+                    return False
+        slots = self.slots
+        mask = self.mask
+        slot = key & mask
+        while True:
+            stored = slots[slot]
+            if stored == key:
+                return True
+            if not stored:
+                return False
+            slot = (slot + 1) & mask
+
+    def add(self, key):
+        """
+        :return: True if the fingerprint is new, False if it was already in the set
+        """
+        key = key or 1
+        slots = self.slots
+        mask = self.mask
+        slot = key & mask
+        while True:
+            stored = slots[slot]
+            if stored == key:
+                return False
+            if not stored:
+                break
+            slot = (slot + 1) & mask
+        slots[slot] = key
+        if self.bloom is not None:
+            for bit in self.bloom_bits_of(key):
+                self.bloom[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+        if self.count > self.limit:
+            self.grow()
+        return True
+
+    def grow(self):
+        old = self.slots
+        size = 2 * len(old)
+        self.mask = mask = size - 1
+        self.slots = slots = array('Q', bytes(8 * size))
+        self.limit = int(self.MAX_LOAD * size)
+        for key in old:
+            if key:
+                slot = key & mask
+                while slots[slot]:
+                    slot = (slot + 1) & mask
+                slots[slot] = key
+
+    def collision_probability(self):
+        return collision_probability(self.count)
+
+
+class ClosedSet(FingerprintSet):
+    """
+    FingerprintSet behind the TranspositionTable interface, so a search can use either one
+    as its explored set. Only expanded states are stored, with no costs: improve accepts
+    any state that has not been expanded, and get, called as a node is popped, marks the
+    state expanded or, if it already was, reports it as reached at cost -1 so the node is
+    skipped. This is the classic closed list: duplicates are only caught once expanded, and
+    A* stays optimal as long as the heuristic is consistent.
+    """
+
+    def get(self, key):
+        return None if self.add(key) else -1
+
+    def improve(self, key, g):
+        return key not in self
+
+
+class BucketQueue:
+    """
+    Open list for small integer priorities. There is one bucket per f value, split again by
+    h so that ties on f go to the node closest to the goal, and each (f, h) bucket is a plain
+    list used as a stack. Like min_f for the rows, each row keeps the lowest h that may still
+    hold a node, so push and pop are O(1) apart from stepping over buckets emptied since (each
+    is stepped over once per push below it), and no Python-level node comparisons are made.
+
+    Deletion is lazy: discard only marks a node, which pop skips over later, and
+    decrease_key is discard followed by a push at the new priority. A keyed queue also
+    indexes its live nodes by zkey, so that a search finding a cheaper path to a queued
+    state can look up the queued node and replace it (Astar and UCS do); the others skip
+    popped nodes whose g is no longer the best known instead.
+
+    Priorities must stay below MAX_PRIORITY: the buckets are a dense list, so a priority
+    of UNREACHABLE would allocate a million empty rows. Searches prune unsolvable states
+    before they get here, and push refuses anything larger with a ValueError.
+    """
+    MAX_PRIORITY = SokobanMap.UNREACHABLE
+
+    def __init__(self, keyed=False):
+        self.buckets = []  # buckets[f][h] -> list of nodes
+        self.min_f = 0
+        self.min_h = []  # min_h[f]: no bucket of row f below this h holds a node
+        self.size = 0  # live (not discarded) nodes
+        self.removed = set()  # ids of discarded nodes still sitting in a bucket
+        self.queued = {} if keyed else None  # zkey -> live node, for keyed queues
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        """
+        Every queued node, in no particular order
+        """
+        for row in self.buckets:
+            for entries in row:
+                for node in entries:
+                    if id(node) not in self.removed:
+                        yield node
+
+    def push(self, node, f, h):
+        if f >= self.MAX_PRIORITY or h >= self.MAX_PRIORITY:
+            raise ValueError('priority (%d, %d) too large for a BucketQueue' % (f, h))
+        buckets = self.buckets
+        while len(buckets) <= f:
+            buckets.append([])
+            self.min_h.append(sys.maxsize)
+        row = buckets[f]
+        while len(row) <= h:
+            row.append([])
+        row[h].append(node)
+        if h < self.min_h[f]:
+            self.min_h[f] = h
+        self.size += 1
+        if self.queued is not None:
+            self.queued[node.zkey] = node
+        if f < self.min_f:  # only possible with an inconsistent heuristic
+            self.min_f = f
+
+    def pop(self):
+        """
+        Remove and return a node with the lowest f, breaking ties on lowest h
+        """
+        buckets = self.buckets
+        min_h = self.min_h
+        while self.size:
+            f = self.min_f
+            if f < len(buckets):
+                row = buckets[f]
+                h = min_h[f]
+                while h < len(row):
+                    entries = row[h]
+                    while entries:
+                        node = entries.pop()
+                        if id(node) in self.removed:
+                            self.removed.discard(id(node))
+                            continue
+                        self.size -= 1
+                        if self.queued is not None:
+                            del self.queued[node.zkey]
+                        min_h[f] = h
+                        return node
+                    h += 1
+                min_h[f] = h
+            self.min_f += 1
+        raise IndexError('pop from an empty BucketQueue')
+
+    def get(self, key):
+        """
+        :return: the live queued node for the state with this zkey, or None (keyed queues only)
+        """
+        return self.queued.get(key)
+
+    def memory(self):
+        """
+        Estimated bytes held by the bucket lists, the key index and the set of discarded
+        nodes (not the nodes in them)
+        """
+        size = sys.getsizeof(self.buckets) + sys.getsizeof(self.min_h) + sys.getsizeof(self.removed)
+        size += sum(sys.getsizeof(key) for key in self.removed)
+        if self.queued is not None:
+            size += sys.getsizeof(self.queued)
+        for row in self.buckets:
+            size += sys.getsizeof(row)
+            for entries in row:
+                size += sys.getsizeof(entries)
+        return size
+
+    def drop_worst(self, count):
+        """
+        Throw away up to `count` queued nodes with the highest f (then highest h), freeing
+        buckets that become empty at the top
+        :return: number of live nodes dropped
+        """
+        buckets = self.buckets
+        dropped = 0
+        while dropped < count and len(buckets) > self.min_f:
+            row = buckets[-1]
+            while dropped < count and row:
+                entries = row[-1]
+                while dropped < count and entries:
+                    node = entries.pop()
+                    if id(node) in self.removed:
+                        self.removed.discard(id(node))
+                        continue
+                    self.size -= 1
+                    dropped += 1
+                    if self.queued is not None:
+                        del self.queued[node.zkey]
+                if not entries:
+                    row.pop()
+            if not row:
+                buckets.pop()
+                self.min_h.pop()
+        return dropped
+
+    def discard(self, node):
+        """
+        Lazily delete a node that is currently queued
+        """
+        self.removed.add(id(node))
+        self.size -= 1
+        if self.queued is not None and self.queued.get(node.zkey) is node:
+            del self.queued[node.zkey]
+
+    def decrease_key(self, old, node, f, h):
+        """
+        Replace the queued node `old` with `node` (normally the same state on a cheaper path)
+        """
+        self.discard(old)
+        self.push(node, f, h)
+
+
+def resident_bytes():
+    """
+    Resident set size of this process in bytes, or None where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def timed(function, phase_time, phase):
+    """
+    Wrap function so that the time spent in it is added to phase_time[phase]
+    """
+    clock = time.perf_counter
+
+    def wrapper(*args):
+        start = clock()
+        result = function(*args)
+        phase_time[phase] += clock() - start
+        return result
+    return wrapper
+
+
+class SearchStats:
+    """
+    Result and counters of one search run, returned by every search in place of the old
+    [time, expanded, frontier, solution] list. It is truthy only when a solution was found,
+    so `if result:` still tells a solve from a failure.
+
+    With a progress stream set, the search calls checkpoint every CHECK_EVERY expansions and
+    a JSON line of the current counters is written at most once per progress_interval
+    seconds, plus a final line when the search ends.
+    """
+    __slots__ = ('algorithm', 'solution', 'time', 'generated', 'expanded', 'duplicates',
+                 'pruned_dead', 'pruned_frozen', 'frontier', 'frontier_max', 'explored',
+                 'phase_time', 'directions', 'status', 'dropped', 'memory', 'cached', 'suboptimality',
+                 'collision_probability', 'progress', 'progress_interval', 'start', 'next_report')
+
+    PHASES = ('moves', 'heuristic', 'hashing')
+    CHECK_EVERY = 1024  # a power of two, tested as `not expanded & (CHECK_EVERY - 1)`
+
+    def __init__(self, algorithm, progress=None, progress_interval=1.0):
+        """
+        :param progress: writable text stream for JSON-lines progress reports, or None
+        """
+        self.algorithm = algorithm
+        self.solution = None  # list of moves, None if no solution was found
+        self.time = 0.0
+        self.generated = 0  # children that are legal moves / pushes
+        self.expanded = 0
+        self.duplicates = 0  # children already reached at no greater cost
+        self.pruned_dead = 0
+        self.pruned_frozen = 0
+        self.frontier = 0  # nodes still queued when the search ended
+        self.frontier_max = 0
+        self.explored = 0  # distinct states recorded
+        self.phase_time = None  # {phase: seconds} when the search was profiled
+        self.directions = None  # per-direction counters of the bidirectional search
+        self.status = None  # 'solved', 'no solution' or 'memory budget', set by finish
+        self.dropped = 0  # frontier nodes thrown away to stay under the memory limit
+        self.memory = None  # {structure: estimated bytes} at the peak total, when a limit is set
+        self.cached = False  # True when the result came from a LevelCache rather than a search
+        self.suboptimality = None  # bound on solution length / optimal length, for anytime searches
+        self.collision_probability = None  # chance of a fingerprint collision among the explored states
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.start = time.perf_counter()
+        self.next_report = self.start
+
+    def __bool__(self):
+        return self.solution is not None
+
+    def final(self):
+        """
+        True if the result does not depend on the limits the search ran under: the level was
+        solved or shown unsolvable, with no frontier nodes dropped and, for an anytime
+        search, a solution proven optimal. Only final results are cached.
+        """
+        return (self.status in ('solved', 'no solution') and not self.dropped
+                and (self.suboptimality is None or self.suboptimality <= 1.0))
+
+    def as_dict(self):
+        """
+        Counters as a JSON-serialisable dict (the solution as a move string)
+        """
+        result = {'algorithm': self.algorithm, 'solved': bool(self),
+                  'solution': ''.join(self.solution) if self.solution is not None else None}
+        for name in ('status', 'time', 'generated', 'expanded', 'duplicates', 'pruned_dead', 'pruned_frozen',
+                     'frontier', 'frontier_max', 'explored', 'dropped', 'memory', 'phase_time', 'directions',
+                     'cached', 'suboptimality', 'collision_probability'):
+            result[name] = getattr(self, name)
+        return result
+
+    @classmethod
+    def from_dict(cls, fields):
+        """
+        Rebuild a result saved with as_dict
+        """
+        stats = cls(fields['algorithm'])
+        for name, value in fields.items():
+            if name == 'solution':
+                value = list(value) if value is not None else None
+            if name in cls.__slots__:
+                setattr(stats, name, value)
+        return stats
+
+    def checkpoint(self, frontier, bound=None):
+        """
+        Write a progress line if one is due
+        :param frontier: current number of queued nodes
+        :param bound: current f (or depth) bound, if the search has one
+        """
+        if self.progress is None:
+            return
+        now = time.perf_counter()
+        if now < self.next_report:
+            return
+        self.next_report = now + self.progress_interval
+        if frontier > self.frontier_max:
+            self.frontier_max = frontier
+        self.report('progress', elapsed=now - self.start, expanded=self.expanded, generated=self.generated,
+                    duplicates=self.duplicates, frontier=frontier, frontier_max=self.frontier_max, bound=bound)
+
+    def finish(self, solution, frontier, status=None):
+        """
+        Record the outcome and stop the clock
+        :param status: overrides the status derived from the solution
+        :return: self
+        """
+        if status is None:
+            if solution is not None:
+                status = 'solved'
+            elif self.dropped:
+                status = 'memory budget'  # the search space was not exhausted, only cut down
+            else:
+                status = 'no solution'
+        self.status = status
+        self.solution = solution
+        self.frontier = frontier
+        self.time = time.perf_counter() - self.start
+        if self.progress is not None:
+            line = self.as_dict()
+            line['length'] = len(line.pop('solution')) if self else None
+            self.report('done', **line)
+        return self
+
+    def report(self, event, **fields):
+        fields['event'] = event
+        self.progress.write(json.dumps(fields) + '\n')
+        self.progress.flush()
+
+
 def main(arglist):
     """
-    Run a playable game of Sokoban using the given filename as the map file.
-    :param arglist: map file name
+    Solve the given Sokoban map file and print the move list followed by the search statistics.
+    :param arglist: map file name, optionally followed by
+                    --algorithm {astar,ucs,push,ida,bidir,ara,external,batch,batch-ucs} and the
+                    options below (see --help)
     """
-    
-    map_inst = SokobanMap(arglist[0])
-    
-    output = map_inst.Astar()
+    parser = argparse.ArgumentParser(description='Solve a Sokoban map file.')
+    parser.add_argument('map_file')
+    parser.add_argument('-a', '--algorithm', choices=list(SokobanMap.SEARCHES), default='astar',
+                        help='astar/ucs/ida expand single player steps, push runs A* over box pushes, '
+                             'bidir meets a forward push search with a backward pull search, '
+                             'ara is anytime weighted A* over steps, external is a disk-based BFS over steps, '
+                             'batch/batch-ucs expand blocks of steps with NumPy')
+    parser.add_argument('--heuristic', choices=['manhattan', 'greedy', 'matching', 'pdb'], default='manhattan',
+                        help='box heuristic for astar and push (greedy is not admissible)')
+    parser.add_argument('--pdb-dir', default=pattern_db.DEFAULT_DIR,
+                        help='pattern database directory for --heuristic pdb (default %(default)s)')
+    parser.add_argument('--pdb-size', type=int, default=pattern_db.DEFAULT_SIZE,
+                        help='largest box subset in the pattern database (default %(default)s)')
+    parser.add_argument('--check-heuristic', action='store_true',
+                        help='debug: assert every incremental heuristic update against a full recomputation')
+    parser.add_argument('--tt-size', type=int, default=TranspositionTable.DEFAULT_SIZE,
+                        help='transposition table entries (default %(default)s)')
+    parser.add_argument('--explored', choices=['table', 'fingerprint'], default='table',
+                        help='astar/ucs/push explored set: the transposition table, or a growing set of '
+                             '64-bit fingerprints of expanded states (default %(default)s)')
+    parser.add_argument('--bloom-bits', type=int, default=0,
+                        help='Bloom filter bits in front of --explored fingerprint, 0 for none')
+    parser.add_argument('--ida-tt-size', type=int, default=1 << 16,
+                        help='IDA* transposition table entries, 0 for none (default %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='report the search counters on stderr')
+    parser.add_argument('--profile', action='store_true',
+                        help='time move generation, heuristic and hashing (reported with -v)')
+    parser.add_argument('--progress', metavar='FILE',
+                        help="write JSON-lines progress reports to FILE ('-' for stderr)")
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help='seconds between progress reports (default %(default)s)')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='reuse solutions and distance tables stored in DIR, and store new ones there')
+    parser.add_argument('--cache-size', type=int, default=level_cache.DEFAULT_SIZE // (1024 * 1024), metavar='MB',
+                        help='size the cache directory is trimmed to, least recently used first (default %(default)s)')
+    parser.add_argument('--verify-cache', action='store_true',
+                        help='replay cached solutions before returning them')
+    parser.add_argument('--weight', type=float, default=3.0,
+                        help='ara: starting heuristic weight (default %(default)s)')
+    parser.add_argument('--weight-step', type=float, default=0.5,
+                        help='ara: weight decrease per pass (default %(default)s)')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='ara: stop improving the solution after this long')
+    parser.add_argument('--spill-dir', metavar='DIR',
+                        help='external: directory for the run files (default: system temp)')
+    parser.add_argument('--spill-states', type=int, default=external_search.DEFAULT_SPILL_STATES,
+                        help='external: child states buffered in memory per run (default %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=batch_search.BLOCK_STATES,
+                        help='batch: states expanded together (default %(default)s)')
+    parser.add_argument('--memory-limit', type=int, default=0, metavar='MB',
+                        help='estimated memory a search may use before it drops frontier nodes and then '
+                             'gives up (0: no limit)')
+    args = parser.parse_args(arglist)
+    if args.algorithm.startswith('batch') and batch_search.np is None:
+        parser.error('the batch searches need NumPy')
+
+    cache = level_cache.LevelCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    map_inst = SokobanMap(args.map_file, args.heuristic, cache)
+    if args.verbose and map_inst.table_time:
+        print('%d cells, distance tables built with %s: ' % (len(map_inst.cells), 'NumPy' if np is not None else 'Python')
+              + ', '.join('%s %.4fs' % item for item in map_inst.table_time.items()), file=sys.stderr)
+    elif args.verbose:
+        print('%d cells, distance tables loaded from the cache' % len(map_inst.cells), file=sys.stderr)
+    map_inst.check_heuristic = args.check_heuristic
+    map_inst.tt_size = args.tt_size
+    map_inst.ida_tt_size = args.ida_tt_size
+    map_inst.explored_backend = args.explored
+    map_inst.bloom_bits = args.bloom_bits
+    map_inst.profile = args.profile
+    map_inst.pdb_dir = args.pdb_dir
+    map_inst.ara_weight = args.weight
+    map_inst.ara_step = args.weight_step
+    map_inst.deadline = args.deadline
+    map_inst.spill_dir = args.spill_dir
+    map_inst.spill_states = args.spill_states
+    map_inst.batch_size = args.batch_size
+    map_inst.pdb_size = args.pdb_size
+    map_inst.memory_limit = args.memory_limit * 1024 * 1024
+    map_inst.progress_interval = args.progress_interval
+    if args.progress == '-':
+        map_inst.progress = sys.stderr
+    elif args.progress:
+        map_inst.progress = open(args.progress, 'w')
+    output = map_inst.search(args.algorithm, cache, args.verify_cache)
     if output:
-        print(output[3])
-        print([output[1] + output[2],  output[2], output[1],output[0]])
+        print(output.solution)
+        print([output.expanded + output.frontier, output.frontier, output.expanded, output.time])
+    elif output.status == 'memory budget':
+        print("Solution not found within the memory limit")
+    elif output.status == 'deadline':
+        print("Solution not found before the deadline")
     else:
         print("Solution not found")
+    if args.verbose:
+        print('generated =', output.generated, 'duplicates =', output.duplicates, 'explored =', output.explored,
+              'peak frontier =', output.frontier_max, file=sys.stderr)
+        print('pruned: dead squares =', output.pruned_dead, 'frozen boxes =', output.pruned_frozen,
+              file=sys.stderr)
+        if output.collision_probability is not None:
+            print('fingerprint collision probability = %.3g' % output.collision_probability, file=sys.stderr)
+        if output.suboptimality is not None:
+            print('solution is at most %.2f times the optimal length' % output.suboptimality, file=sys.stderr)
+        if output.cached:
+            print('result taken from the cache in', args.cache, file=sys.stderr)
+        if output.memory is not None:
+            print('peak memory estimate: ' + ', '.join('%s = %d' % item for item in output.memory.items()),
+                  'dropped =', output.dropped, file=sys.stderr)
+        if output.phase_time is not None:
+            print('time: ' + ', '.join('%s = %.3f' % item for item in output.phase_time.items()), file=sys.stderr)
+        if output.directions is not None:
+            for side, side_stats in output.directions.items():
+                print(side, 'expanded =', side_stats['expanded'], 'time =', side_stats['time'], file=sys.stderr)
+    if map_inst.progress is not None and map_inst.progress is not sys.stderr:
+        map_inst.progress.close()
 #    print(len(output[3]))
     
 
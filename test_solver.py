@@ -0,0 +1,166 @@
+import os
+import random
+
+import pytest
+
+from solver import SokobanMap, Node, BucketQueue, TranspositionTable, FingerprintSet, ClosedSet
+from batch_solver import find_levels
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEVELS = find_levels([os.path.join(HERE, 'testcases')])
+# single-step A* needs minutes and millions of nodes on these, too slow for a test run
+SLOW = {os.path.join('new', '4box_m2.txt'), os.path.join('new', '4box_m3.txt')}
+
+
+@pytest.mark.parametrize('level', [level for level in LEVELS
+                                   if os.path.relpath(level, os.path.join(HERE, 'testcases')) not in SLOW],
+                         ids=lambda level: os.path.relpath(level, os.path.join(HERE, 'testcases')))
+@pytest.mark.parametrize('heuristic', ['manhattan', 'matching'])
+def test_push_matches_astar_length(level, heuristic):
+    """
+    The push search counts g in player moves, so its solutions are as short as astar's
+    """
+    push = SokobanMap(level, heuristic).search('push')
+    astar = SokobanMap(level, heuristic).search('astar')
+    assert push and astar
+    assert SokobanMap(level, heuristic).replay(push.solution)
+    assert len(push.solution) == len(astar.solution)
+
+
+@pytest.mark.parametrize('algorithm', ['astar', 'push', 'ara', 'ida'])
+def test_unsolvable_root(tmp_path, algorithm):
+    """
+    A box starting on a dead square is reported unsolvable without queueing the root at
+    f = UNREACHABLE
+    """
+    level = tmp_path / 'dead.txt'
+    level.write_text('#######\n#B   T#\n#  P  #\n#######\n')
+    output = SokobanMap(str(level), 'matching').search(algorithm)
+    assert not output and output.expanded == 0
+
+
+@pytest.mark.parametrize('algorithm', ['astar', 'push', 'ida'])
+def test_greedy_skips_unreachable_pairs(tmp_path, algorithm):
+    """
+    Greedily pairing the lower box with its nearest target leaves the other box only a
+    target it can never reach; the state is still solvable and must not be pruned
+    """
+    level = tmp_path / 'greedy.txt'
+    level.write_text('########\n#    # #\n#      #\n# PB T #\n# BT ###\n########\n')
+    map_inst = SokobanMap(str(level), 'greedy')
+    output = map_inst.search(algorithm)
+    assert output and len(output.solution) == 6
+    assert map_inst.replay(output.solution)
+
+
+@pytest.mark.parametrize('algorithm', ['astar', 'ucs', 'push', 'ida', 'bidir', 'ara', 'external'])
+def test_no_boxes(tmp_path, algorithm):
+    """
+    A level without boxes or targets is solved by the empty move list
+    """
+    level = tmp_path / 'empty.txt'
+    level.write_text('#####\n#P  #\n#####\n')
+    output = SokobanMap(str(level), 'matching').search(algorithm)
+    assert output and output.solution == []
+
+
+def test_pdb_larger_subsets(tmp_path):
+    """
+    A database holding 4-box subsets is read by lower_bound: it stays admissible and
+    prunes at least as well as the 3-box one
+    """
+    level = os.path.join(HERE, 'testcases', 'new', '4box_m1.txt')
+    results = {}
+    for size in (3, 4):
+        map_inst = SokobanMap(level, 'pdb')
+        map_inst.pdb_dir = str(tmp_path / str(size))
+        map_inst.pdb_size = size
+        results[size] = map_inst.search('push')
+        assert map_inst.pattern_db.size == size
+    optimal = SokobanMap(level, 'matching').search('push')
+    assert len(results[3].solution) == len(results[4].solution) == len(optimal.solution)
+    assert results[4].expanded < results[3].expanded
+
+
+def queued_node(zkey):
+    node = Node()
+    node.zkey = zkey
+    return node
+
+
+def test_bucket_queue_decrease_key():
+    """
+    A node replaced by decrease_key is skipped by pop, and its replacement comes out at the
+    new priority ahead of nodes it used to follow
+    """
+    queue = BucketQueue(keyed=True)
+    old, other, tie = queued_node(1), queued_node(2), queued_node(3)
+    queue.push(old, 5, 3)
+    queue.push(other, 4, 2)
+    queue.push(tie, 3, 2)
+    new = queued_node(1)
+    queue.decrease_key(old, new, 3, 1)
+    assert len(queue) == 3 and queue.get(1) is new
+    assert [queue.pop() for i in range(3)] == [new, tie, other]
+    assert not queue and queue.get(1) is None
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_bucket_queue_drop_worst():
+    """
+    drop_worst removes the highest priorities first, skips discarded nodes without counting
+    them, and leaves min_f no higher than any live node, even after emptying the queue
+    """
+    queue = BucketQueue(keyed=True)
+    nodes = [queued_node(i) for i in range(8)]
+    for i, node in enumerate(nodes):
+        queue.push(node, 2 + i // 2, i % 2)
+    assert queue.pop() is nodes[0]
+    queue.discard(nodes[7])
+    assert queue.drop_worst(2) == 2
+    assert len(queue) == 4 and queue.get(6) is None and queue.get(5) is None and not queue.removed
+    assert queue.min_f <= 2
+    assert [queue.pop() for i in range(2)] == [nodes[1], nodes[2]]
+    assert queue.drop_worst(10) == 2
+    assert not queue and queue.min_f <= len(queue.buckets)
+    queue.push(nodes[0], queue.min_f, 0)
+    assert queue.pop() is nodes[0]
+
+
+def test_transposition_table_eviction():
+    """
+    Once a small table is full, overwritten states are forgotten, but a lookup never returns
+    the cost of another state
+    """
+    table = TranspositionTable(16)
+    rng = random.Random(1)
+    best = {}
+    for i in range(2000):
+        key = rng.choice([rng.getrandbits(64), rng.randrange(64)])  # many keys share a probe window
+        g = rng.randrange(100)
+        if table.improve(key, g):
+            best[key] = g
+        for key, g in best.items():
+            assert table.get(key) in (None, g)
+    assert table.count <= 16
+
+
+@pytest.mark.parametrize('bloom_bits', [0, 1 << 10])
+def test_fingerprint_set_grow(bloom_bits):
+    """
+    Every fingerprint added is still found after the array has doubled several times,
+    with or without the Bloom filter in front
+    """
+    fingerprints = FingerprintSet(4, bloom_bits)
+    rng = random.Random(2)
+    keys = [0, 1] + [rng.getrandbits(64) for i in range(1000)]
+    for key in keys:
+        assert fingerprints.add(key) == (key != 1)  # 0 is stored as 1
+    assert len(fingerprints.slots) > 1000 and len(fingerprints) == len(keys) - 1
+    assert all(key in fingerprints for key in keys)
+    assert not any(rng.getrandbits(64) in fingerprints for i in range(1000))
+    closed = ClosedSet(bloom_bits=bloom_bits)
+    for key in keys[2:]:
+        assert closed.improve(key, 0) and closed.get(key) is None
+    assert all(closed.get(key) == -1 and not closed.improve(key, 0) for key in keys[2:])